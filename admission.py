@@ -0,0 +1,188 @@
+# ============================
+# ADMISSION CONTROL
+# ============================
+# Bounds how many analyses run at once and in what order the rest start.
+# Without it every upload in a burst starts decoding and preprocessing at
+# the same time, OpenCV/torch threads from all of them fight over the same
+# cores, and everybody's latency collapses together.
+#
+# - at most max_concurrent tickets are admitted (running) at any time
+# - waiting tickets are queued per user and admitted round-robin across
+#   users, so one clinician uploading a folder cannot starve the others
+# - the queue is bounded, overall and per user; past that, enqueue() sheds
+#   the request with Busy(position) instead of letting the backlog (and
+#   every queued user's wait) grow without limit
+# - queue wait (enqueue -> admit) is kept for p50/p95 and, with
+#   DR_INSTRUMENTATION=1, exported as the "admission_queue_wait" stage
+
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+from instrumentation import enabled as instrumentation_enabled, record
+
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("DR_ANALYSIS_QUEUE", "32"))
+ANALYSIS_QUEUE_PER_USER = int(os.environ.get("DR_ANALYSIS_QUEUE_PER_USER", "4"))
+ANONYMOUS = "anonymous"
+
+
+class Busy(RuntimeError):
+    """Request shed; position is where it would have waited in the queue."""
+
+    def __init__(self, position, reason):
+        super().__init__(f"busy, position {position}: {reason}")
+        self.position = position
+        self.reason = reason
+
+
+class Ticket:
+    __slots__ = ("user", "item", "enqueued_at", "admitted_at")
+
+    def __init__(self, user, item):
+        self.user = user
+        self.item = item
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at = None
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queued=ANALYSIS_QUEUE_SIZE,
+                 max_queued_per_user=ANALYSIS_QUEUE_PER_USER, wait_window=1000):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be >= 1")
+
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+
+        # user -> deque of tickets; dict order is the round-robin order
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=wait_window)
+        self._stats = {"admitted": 0, "shed": 0, "withdrawn": 0}
+
+    # ---------- public API ----------
+
+    def enqueue(self, user, item):
+        """Queue item for user; returns its Ticket or raises Busy."""
+        user = user or ANONYMOUS
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("AdmissionController is closed")
+            mine = self._queues.get(user, ())
+            if self._queued >= self.max_queued:
+                self._stats["shed"] += 1
+                raise Busy(self._queued + 1, "queue full")
+            if len(mine) >= self.max_queued_per_user:
+                self._stats["shed"] += 1
+                raise Busy(self._position(user, len(mine)), "too many queued for this user")
+
+            ticket = Ticket(user, item)
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._queued += 1
+            self._cond.notify()
+            return ticket
+
+    def acquire(self, timeout=None):
+        """Block until a slot is free and a ticket waits; admit and return it (None once closed)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._closed and (self._active >= self.max_concurrent or not self._queued):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._closed:
+                return None
+
+            user, waiting = next(iter(self._queues.items()))
+            ticket = waiting.popleft()
+            # served users go to the back of the rotation
+            del self._queues[user]
+            if waiting:
+                self._queues[user] = waiting
+            self._queued -= 1
+            self._active += 1
+            self._stats["admitted"] += 1
+            ticket.admitted_at = time.perf_counter()
+            wait = ticket.admitted_at - ticket.enqueued_at
+            self._waits.append(wait)
+
+        if instrumentation_enabled():
+            record("admission_queue_wait", wait)
+        return ticket
+
+    def release(self, ticket):
+        """Give back the slot of an admitted ticket."""
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def withdraw(self, ticket):
+        """Drop a still-queued ticket; False if it was already admitted."""
+        with self._cond:
+            waiting = self._queues.get(ticket.user)
+            if waiting is None or ticket not in waiting:
+                return False
+            waiting.remove(ticket)
+            if not waiting:
+                del self._queues[ticket.user]
+            self._queued -= 1
+            self._stats["withdrawn"] += 1
+            return True
+
+    def position(self, ticket):
+        """1-based place in admission order, or 0 once admitted (or withdrawn)."""
+        with self._cond:
+            waiting = self._queues.get(ticket.user)
+            if waiting is None or ticket not in waiting:
+                return 0
+            return self._position(ticket.user, waiting.index(ticket))
+
+    def reset_stats(self):
+        with self._cond:
+            self._waits.clear()
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            stats = dict(self._stats)
+            stats.update(active=self._active, queued=self._queued, users_waiting=len(self._queues),
+                         max_concurrent=self.max_concurrent, max_queued=self.max_queued)
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000.0
+
+        stats.update({
+            "wait_ms_mean": (sum(waits) / len(waits) * 1000.0) if waits else 0.0,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": waits[-1] * 1000.0 if waits else 0.0,
+        })
+        return stats
+
+    # ---------- internals ----------
+
+    def _position(self, user, index):
+        # round-robin: a user's index-th ticket goes in round index, after
+        # the users ahead of it in the rotation have had theirs
+        ahead = index
+        before = True
+        for other, waiting in self._queues.items():
+            if other == user:
+                before = False
+                continue
+            ahead += min(len(waiting), index + 1 if before else index)
+        return ahead + 1
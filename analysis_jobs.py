@@ -0,0 +1,207 @@
+# ============================
+# BACKGROUND ANALYSIS JOBS
+# ============================
+# The Reports page submits each upload as a job and keeps only its job_id
+# in st.session_state; a fragment polls the job, so reruns (navigation, any
+# widget) neither block on nor restart the analysis. Jobs pass through an
+# AdmissionController (admission.py): at most DR_ANALYSIS_WORKERS run at
+# once, the rest wait in a bounded queue served round-robin per user, and
+# a submission past the queue bound raises admission.Busy. The heavy
+# lifting is still batched by the inference scheduler or done by the
+# inference service.
+#
+# Identical submissions (same result key) while one is in flight share the
+# job. cancel() drops a session's interest; when nobody is left waiting, a
+# queued job leaves the queue and a running one stops at its next pipeline
+# stage boundary, freeing the worker.
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from admission import AdmissionController, ANALYSIS_QUEUE_SIZE, ANALYSIS_QUEUE_PER_USER
+
+ANALYSIS_WORKERS = int(os.environ.get("DR_ANALYSIS_WORKERS", "4"))
+# finished jobs kept for polling sessions to pick up
+FINISHED_JOBS_KEPT = 256
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class AnalysisJob:
+    def __init__(self, key, fn, user=None):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.user = user
+        self.fn = fn
+        self.future = Future()
+        self.ticket = None
+        self.stage = None
+        self.fraction = 0.0
+        self.waiters = 1
+        self.cancelled = threading.Event()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self, stage, fraction, seconds=None):
+        """run_pipeline progress callback; aborts the pipeline once cancelled."""
+        if self.cancelled.is_set():
+            raise JobCancelled(self.job_id)
+        self.stage, self.fraction = stage, fraction
+
+    @property
+    def state(self):
+        if self.future.cancelled() or self.cancelled.is_set():
+            return "cancelled"
+        if self.future.done():
+            return "failed" if self.future.exception() is not None else "done"
+        return "running" if self.started_at else "queued"
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
+
+    def exception(self):
+        return self.future.exception() if self.future.done() and not self.future.cancelled() else None
+
+
+class JobManager:
+    def __init__(self, max_workers=ANALYSIS_WORKERS, max_queued=ANALYSIS_QUEUE_SIZE,
+                 max_queued_per_user=ANALYSIS_QUEUE_PER_USER, keep_finished=FINISHED_JOBS_KEPT):
+        self.keep_finished = keep_finished
+        self.admission = AdmissionController(max_workers, max_queued, max_queued_per_user)
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "shared": 0, "cancelled": 0, "failed": 0, "completed": 0}
+        self._workers = [
+            threading.Thread(target=self._work, name=f"analysis-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    # ---------- public API ----------
+
+    def submit(self, key, fn, user=None):
+        """
+        Run fn(job) in the background, or join the in-flight job for the
+        same key. Raises admission.Busy when the queue cannot take it.
+        """
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None and not job.cancelled.is_set():
+                job.waiters += 1
+                self._stats["shared"] += 1
+                return job
+
+            job = AnalysisJob(key, fn, user)
+            job.ticket = self.admission.enqueue(user, job)
+            self._jobs[job.job_id] = job
+            self._in_flight[key] = job
+            self._stats["submitted"] += 1
+            self._trim()
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """1-based place in the admission queue; 0 once the job has started."""
+        return self.admission.position(job.ticket)
+
+    def cancel(self, job_id):
+        """Drop one waiter; the job itself is cancelled when none remain."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done() or job.cancelled.is_set():
+                return False
+            job.waiters -= 1
+            if job.waiters > 0:
+                return False
+            job.cancelled.set()
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+            self._stats["cancelled"] += 1
+        if self.admission.withdraw(job.ticket):
+            job.future.cancel()
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            states = [job.state for job in self._jobs.values()]
+        stats["queued"] = states.count("queued")
+        stats["running"] = states.count("running")
+        stats["admission"] = self.admission.stats()
+        return stats
+
+    def shutdown(self):
+        self.admission.close()
+
+    # ---------- workers ----------
+
+    def _work(self):
+        while True:
+            ticket = self.admission.acquire()
+            if ticket is None:
+                return
+            try:
+                self._run(ticket.item)
+            finally:
+                self.admission.release(ticket)
+
+    def _run(self, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        job.started_at = time.time()
+        result = error = None
+        try:
+            if job.cancelled.is_set():
+                raise JobCancelled(job.job_id)
+            result = job.fn(job)
+        except Exception as e:
+            error = e
+
+        job.finished_at = time.time()
+        job.fn = None
+        with self._lock:
+            if self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+            if error is None:
+                self._stats["completed"] += 1
+            elif not isinstance(error, JobCancelled):
+                self._stats["failed"] += 1
+
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def _trim(self):
+        # oldest finished jobs go first; in-flight jobs are never dropped
+        excess = len(self._jobs) - self.keep_finished
+        for job_id in [j for j, job in self._jobs.items() if job.done()][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+
+_JOB_MANAGER = None
+_JOB_MANAGER_LOCK = threading.Lock()
+
+
+def get_job_manager():
+    """Process-wide job manager shared by every session."""
+    global _JOB_MANAGER
+    with _JOB_MANAGER_LOCK:
+        if _JOB_MANAGER is None:
+            _JOB_MANAGER = JobManager()
+        return _JOB_MANAGER
@@ -1,4 +1,6 @@
 import streamlit as st
+from report_utils import prewarm
+from inference_service import INFERENCE_URL
 
 # ================= PAGE CONFIG =================
 st.set_page_config(
@@ -6,6 +8,12 @@ st.set_page_config(
     layout="wide",
 )
 
+# ================= PREWARM =================
+# load torch / cv2 / reportlab in the background while the user logs in
+# (not needed when a separate inference service does the work)
+if INFERENCE_URL is None:
+    prewarm()
+
 # ================= AUTH GATE =================
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
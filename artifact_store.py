@@ -0,0 +1,335 @@
+# ============================
+# THUMBNAIL & REPORT STORE
+# ============================
+# What the History page needs to show an upload and hand its report out
+# again without re-running the pipeline, kept on disk (DR_ARTIFACT_DIR):
+#
+#   blobs/<ab>/<sha256>.<ext>   content-addressed bytes: WebP (or JPEG)
+#                               thumbnails, report JPEGs, rendered PDFs
+#   results/<result_key>.json   class, stage, probability, model version
+#                               and the blob names of the thumbnail, the PDF
+#                               (once rendered) and the two report images it
+#                               is rendered from
+#
+# Identical uploads (same result_key) share one manifest and identical
+# bytes share one blob. A PDF that was never rendered is rendered from the
+# stored report images on first re-download (generate_pdf only) and
+# stored. Writes are atomic renames, so readers never see partial files.
+#
+# Total size is bounded by DR_ARTIFACT_MAX_BYTES: once over, the least
+# recently used manifests go first, then every blob no manifest refers to,
+# down to GC_LOW_WATERMARK of the bound.
+
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import report_utils as ru
+from atomic_files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.environ.get("DR_ARTIFACT_DIR", "artifacts")
+ARTIFACT_MAX_BYTES = int(os.environ.get("DR_ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+GC_LOW_WATERMARK = 0.9
+THUMBNAIL_SIZE = 160
+THUMBNAIL_QUALITY = 70
+
+
+def make_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    """(bytes, mime) of an upload shrunk to size px on its long side, WebP if available."""
+    buf = ru.np.frombuffer(image_bytes, dtype=ru.np.uint8)
+    flag, _ = ru.reduced_decode_flag(buf, target=size)
+    img = ru.cv2.imdecode(buf, flag)
+    if img is None:
+        raise ValueError("Could not decode image")
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    if scale < 1:
+        img = ru.cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))),
+                            interpolation=ru.cv2.INTER_AREA)
+
+    ok, enc = ru.cv2.imencode(".webp", img, [ru.cv2.IMWRITE_WEBP_QUALITY, THUMBNAIL_QUALITY])
+    if ok:
+        return enc.tobytes(), "image/webp"
+    # OpenCV built without libwebp
+    ok, enc = ru.cv2.imencode(".jpg", img, [ru.cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return enc.tobytes(), "image/jpeg"
+
+
+class ArtifactStore:
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, "blobs")
+        self._results = os.path.join(root, "results")
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._results, exist_ok=True)
+        self._lock = threading.Lock()
+        self._gc_lock = threading.Lock()
+        # bytes on disk, counted on the first GC check and tracked after that
+        self._total = None
+        self._stats = {"stored": 0, "pdf_renders": 0, "gc_runs": 0, "gc_removed": 0}
+
+    # ---------- public API ----------
+
+    def put(self, result_key, image_bytes, cls, prob, report=None, model_version=None):
+        """
+        Store the thumbnail and result of one analysis. report is the
+        DeferredReport / RemoteReport / PDF bytes from the pipeline; its PDF
+        is stored now if rendered, else as soon as something renders it.
+        """
+        try:
+            manifest = self._put(result_key, image_bytes, cls, prob, report, model_version)
+        except OSError as e:
+            # history then just shows no thumbnail; the analysis itself stands
+            logger.warning("Artifact store write failed: %s", e)
+            return None
+        if manifest["pdf"] is None and hasattr(report, "add_done_callback"):
+            report.add_done_callback(lambda pdf: self._attach_pdf(result_key, pdf))
+        with self._lock:
+            self._stats["stored"] += 1
+        self._maybe_gc()
+        return manifest
+
+    def get(self, result_key):
+        """Manifest for result_key, or None (never stored, or collected)."""
+        path = self._manifest_path(result_key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            os.utime(path)  # recently viewed entries survive GC longest
+        except (OSError, ValueError):
+            return None
+        return manifest
+
+    def thumbnails(self, result_keys):
+        """{result_key: (bytes, mime)} for those of result_keys that have one."""
+        found = {}
+        for key in result_keys:
+            manifest = self.get(key) if key else None
+            data = manifest and self._read_blob(manifest["thumbnail"])
+            if data is not None:
+                mime = "image/webp" if manifest["thumbnail"].endswith(".webp") else "image/jpeg"
+                found[key] = (data, mime)
+        return found
+
+    def has_report(self, result_key):
+        manifest = self.get(result_key)
+        return bool(manifest and (manifest["pdf"] or manifest["report_images"]))
+
+    def report_images(self, result_key):
+        """(original_jpeg, processed_jpeg) the report of result_key is rendered from, or None."""
+        manifest = self.get(result_key)
+        return self._report_images(manifest) if manifest else None
+
+    def report_pdf(self, result_key):
+        """The stored PDF, rendering (and storing) it from the report images if needed."""
+        manifest = self.get(result_key)
+        if manifest is None:
+            raise KeyError(result_key)
+        if manifest["pdf"]:
+            pdf = self._read_blob(manifest["pdf"])
+            if pdf is not None:
+                return pdf
+
+        images = self._report_images(manifest)
+        if images is None:
+            raise KeyError(result_key)
+        original, processed = images
+        pdf = ru.generate_pdf(io.BytesIO(original), io.BytesIO(processed), manifest["cls"], manifest["prob"])
+        with self._lock:
+            self._stats["pdf_renders"] += 1
+        self._attach_pdf(result_key, pdf)
+        return pdf
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["bytes"] = self._total
+        return stats
+
+    def gc(self):
+        """Evict down to the low watermark; returns the bytes now on disk."""
+        with self._gc_lock:
+            return self._gc()
+
+    # ---------- storage ----------
+
+    def _manifest_path(self, result_key):
+        return os.path.join(self._results, result_key + ".json")
+
+    def _blob_path(self, name):
+        return os.path.join(self._blobs, name[:2], name)
+
+    def _put(self, result_key, image_bytes, cls, prob, report, model_version):
+        thumb, mime = make_thumbnail(image_bytes)
+        manifest = {
+            "cls": cls,
+            "stage": ru.CLASS_NAMES[cls],
+            "prob": prob,
+            "model_version": model_version,
+            "thumbnail": self._put_blob(thumb, ".webp" if mime == "image/webp" else ".jpg"),
+            "pdf": None,
+            "report_images": None,
+            "created_at": time.time(),
+        }
+        if isinstance(report, (bytes, bytearray)):
+            manifest["pdf"] = self._put_blob(bytes(report), ".pdf")
+        elif getattr(report, "original_jpeg", None) is not None:
+            manifest["report_images"] = [self._put_blob(report.original_jpeg, ".jpg"),
+                                         self._put_blob(report.processed_jpeg, ".jpg")]
+        self._write_manifest(result_key, manifest)
+        return manifest
+
+    def _put_blob(self, data, ext):
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = self._blob_path(name)
+        if os.path.exists(path):
+            os.utime(path)
+            return name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+        self._grow(len(data))
+        return name
+
+    def _report_images(self, manifest):
+        if not manifest["report_images"]:
+            return None
+        original, processed = (self._read_blob(name) for name in manifest["report_images"])
+        if original is None or processed is None:
+            return None
+        return original, processed
+
+    def _read_blob(self, name):
+        try:
+            with open(self._blob_path(name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_manifest(self, result_key, manifest):
+        data = json.dumps(manifest).encode("utf-8")
+        atomic_write(self._manifest_path(result_key), data)
+        self._grow(len(data))
+
+    def _attach_pdf(self, result_key, pdf):
+        try:
+            manifest = self.get(result_key)
+            if manifest is None or manifest["pdf"]:
+                return
+            manifest["pdf"] = self._put_blob(pdf, ".pdf")
+            self._write_manifest(result_key, manifest)
+        except OSError as e:
+            logger.warning("Artifact store write failed: %s", e)
+            return
+        self._maybe_gc()
+
+    # ---------- garbage collection ----------
+
+    def _grow(self, size):
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+
+    def _maybe_gc(self):
+        with self._lock:
+            total = self._total
+        if total is not None and total <= self.max_bytes:
+            return
+        # non-blocking: one GC at a time, other writers carry on
+        if self._gc_lock.acquire(blocking=False):
+            try:
+                self._gc()
+            finally:
+                self._gc_lock.release()
+
+    def _gc(self):
+        started = time.time()
+        manifests, blobs, fresh = [], {}, set()
+        for entry in os.scandir(self._results):
+            if entry.name.endswith(".json"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                manifests.append((st.st_mtime, st.st_size, entry.path))
+        for shard in os.scandir(self._blobs):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if ".tmp" in entry.name:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                blobs[entry.name] = st.st_size
+                if st.st_mtime >= started - 1:
+                    # written or reused (utime) by a put racing this GC
+                    fresh.add(entry.name)
+
+        total = sum(size for _, size, _ in manifests) + sum(blobs.values())
+        if total > self.max_bytes:
+            target = self.max_bytes * GC_LOW_WATERMARK
+            manifests.sort()
+            removed = 0
+            # drop least recently used manifests until what they leave behind
+            # fits; counting all their blobs as freed slightly overestimates
+            # (blobs can be shared), the sweep below recomputes the real total
+            estimate = total
+            while manifests and estimate > target:
+                _, size, path = manifests.pop(0)
+                estimate -= size + sum(blobs.get(name, 0) for name in self._references(path))
+                _remove(path)
+                removed += 1
+
+            referenced = set()
+            for _, _, path in manifests:
+                referenced.update(self._references(path))
+            for name, size in list(blobs.items()):
+                if name not in referenced and name not in fresh:
+                    _remove(self._blob_path(name))
+                    del blobs[name]
+                    removed += 1
+            total = sum(size for _, size, _ in manifests) + sum(blobs.values())
+            with self._lock:
+                self._stats["gc_runs"] += 1
+                self._stats["gc_removed"] += removed
+
+        with self._lock:
+            self._total = total
+        return total
+
+    def _references(self, manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return []
+        names = [manifest.get("thumbnail"), manifest.get("pdf")] + list(manifest.get("report_images") or [])
+        return [name for name in names if name]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_ARTIFACT_STORE = None
+_ARTIFACT_STORE_LOCK = threading.Lock()
+
+
+def get_artifact_store():
+    """Process-wide artifact store shared by every session."""
+    global _ARTIFACT_STORE
+    with _ARTIFACT_STORE_LOCK:
+        if _ARTIFACT_STORE is None:
+            _ARTIFACT_STORE = ArtifactStore()
+        return _ARTIFACT_STORE
@@ -0,0 +1,33 @@
+# ============================
+# ATOMIC FILE WRITES
+# ============================
+# Files other threads or processes may read while they are (re)written
+# (result cache and artifact store entries, exported model graphs, metrics
+# textfiles) are written to a temp name next to the target and renamed onto
+# it, so a reader sees the old file or the new one, never a partial one.
+# Temp names contain ".tmp" followed by the pid and thread id, so
+# concurrent writers of one path never share a temp file.
+
+import os
+import threading
+
+
+def atomic_write(path, data):
+    """
+    Atomically (re)write path. data is bytes, str (written as UTF-8), or a
+    callable save(tmp_path) for writers that need a file name of their own,
+    e.g. torch.jit.save. The temp file is removed if writing fails.
+    """
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    try:
+        if callable(data):
+            data(tmp)
+        else:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            with open(tmp, "wb") as f:
+                f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
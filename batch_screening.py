@@ -0,0 +1,278 @@
+# ============================
+# HEADLESS BATCH SCREENING
+# ============================
+# Bulk screening of archived fundus images without Streamlit:
+#
+#   python -m report_utils IMAGES_DIR_OR_MANIFEST --output results.jsonl
+#          [--pdf-dir reports/] [--workers N] [--batch-size 16] [--model ckpt.pt]
+#
+# Decode + OpenCV preprocessing (and PDF rendering) run in a pool of worker
+# processes; the main process keeps the only copy of the model and runs
+# stacked forward passes of --batch-size images. Results are appended per
+# batch to a JSONL or CSV file (by extension), so an interrupted run picks
+# up where it stopped: images already in the output are skipped, failed
+# ones are retried.
+#
+# A manifest is a .txt file with one image path per line, or a .csv with a
+# "path" column; relative paths are resolved against the manifest's folder.
+
+import os
+import io
+import csv
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import report_utils as ru
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULT_MODEL_PATH = "efficientnet_b3_state_dict.pt"
+CSV_FIELDS = ["path", "stage", "class_index", "prob", "probs", "model_version", "pdf", "error"]
+
+
+# =======================================
+# INPUTS
+# =======================================
+
+def list_images(source):
+    """Image paths from a directory (recursive) or a .txt/.csv manifest, in a stable order."""
+    if os.path.isdir(source):
+        found = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            found.extend(os.path.join(root, f) for f in sorted(files)
+                         if f.lower().endswith(IMAGE_EXTENSIONS))
+        return found
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8", newline="") as f:
+        if source.lower().endswith(".csv"):
+            paths = [row["path"] for row in csv.DictReader(f) if row.get("path")]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in paths]
+
+
+def completed_paths(output):
+    """Paths already screened successfully in an existing output file."""
+    if not os.path.exists(output):
+        return set()
+    done = set()
+    with open(output, "r", encoding="utf-8", newline="") as f:
+        if output.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            if not row.get("error"):
+                done.add(row["path"])
+    return done
+
+
+# =======================================
+# WORKER PROCESSES
+# =======================================
+
+def _init_worker():
+    # one core per worker; the pool provides the parallelism
+    ru.cv2.setNumThreads(1)
+    ru.torch.set_num_threads(1)
+
+
+def _prepare(path, with_pdf):
+    """Worker: file -> model input (numpy) and, for PDFs, the two report JPEGs."""
+    # a file OpenCV cannot process (e.g. all black, nothing to crop) becomes an
+    # error row instead of ending the run
+    try:
+        with open(path, "rb") as f:
+            orig = ru.decode_image(f.read())
+        enhanced, tensor = ru.preprocess_engine.run(orig)
+        item = {"path": path, "tensor": tensor[0].numpy(), "error": None}
+        if with_pdf:
+            item["original_jpeg"] = ru.report_image_buffer(orig).getvalue()
+            item["processed_jpeg"] = ru.report_image_buffer(enhanced, rgb=True).getvalue()
+    except (OSError, ValueError, ru.cv2.error) as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}"}
+    return item
+
+
+def _render_pdf(original_jpeg, processed_jpeg, cls, prob, pdf_path):
+    """Worker: write one report; returns pdf_path."""
+    ru.generate_pdf(io.BytesIO(original_jpeg), io.BytesIO(processed_jpeg), cls, prob,
+                    pdf_path=pdf_path)
+    return pdf_path
+
+
+def _prepared(pool, paths, with_pdf, window):
+    """Worker results in input order, keeping at most window images in flight."""
+    paths = iter(paths)
+    pending = deque()
+    for path in paths:
+        pending.append(pool.submit(_prepare, path, with_pdf))
+        if len(pending) >= window:
+            break
+    while pending:
+        yield pending.popleft().result()
+        path = next(paths, None)
+        if path is not None:
+            pending.append(pool.submit(_prepare, path, with_pdf))
+
+
+# =======================================
+# OUTPUT
+# =======================================
+
+class ResultWriter:
+    """Appends rows to JSONL or CSV, flushing after every batch."""
+
+    def __init__(self, output):
+        self.csv = output.lower().endswith(".csv")
+        new = not os.path.exists(output) or os.path.getsize(output) == 0
+        self._f = open(output, "a", encoding="utf-8", newline="")
+        if self.csv:
+            self._writer = csv.DictWriter(self._f, fieldnames=CSV_FIELDS)
+            if new:
+                self._writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.csv:
+                probs = row["probs"]
+                self._writer.writerow(dict(row, probs=json.dumps(probs) if probs is not None else ""))
+            else:
+                self._f.write(json.dumps(row) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def _pdf_path(pdf_dir, path):
+    # same file name in two archive folders must not share a report
+    stem = os.path.splitext(os.path.basename(path))[0]
+    tag = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(pdf_dir, f"{stem}_{tag}.pdf")
+
+
+# =======================================
+# DRIVER
+# =======================================
+
+def screen(paths, output, model_path, pdf_dir=None, workers=None, batch_size=ru.MAX_BATCH_SIZE):
+    """Screen paths into output; returns summary counts and timings."""
+    model, class_names = ru.get_model(model_path)
+    version = ru.model_version(model_path)
+    if pdf_dir:
+        os.makedirs(pdf_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    writer = ResultWriter(output)
+    summary = {"images": 0, "errors": 0, "pdfs": 0, "inference_seconds": 0.0}
+    started = time.perf_counter()
+
+    def write_finished_pdfs(pdf_jobs, wait=False):
+        # rows with a PDF are written once it exists, so resuming never skips a missing report
+        rows = []
+        while pdf_jobs and (wait or pdf_jobs[0][0].done()):
+            job, row = pdf_jobs.popleft()
+            job.result()
+            rows.append(row)
+        summary["pdfs"] += len(rows)
+        writer.write(rows)
+
+    def flush(pool, batch, pdf_jobs):
+        ready = [item for item in batch if item["error"] is None]
+        if ready:
+            t0 = time.perf_counter()
+            tensor = ru.torch.from_numpy(ru.np.stack([item["tensor"] for item in ready]))
+            predictions = ru.predict_batch(model, tensor, class_names)
+            summary["inference_seconds"] += time.perf_counter() - t0
+            for item, result in zip(ready, predictions):
+                item["result"] = result
+
+        rows = []
+        for item in batch:
+            row = {"path": item["path"], "stage": None, "class_index": None, "prob": None,
+                   "probs": None, "model_version": version, "pdf": None, "error": item["error"]}
+            if item["error"] is not None:
+                summary["errors"] += 1
+                rows.append(row)
+                continue
+
+            cls, prob, probs = item["result"]
+            row.update(stage=class_names[cls], class_index=cls, prob=prob, probs=probs)
+            if pdf_dir:
+                row["pdf"] = _pdf_path(pdf_dir, item["path"])
+                job = pool.submit(_render_pdf, item["original_jpeg"], item["processed_jpeg"],
+                                  cls, prob, row["pdf"])
+                pdf_jobs.append((job, row))
+            else:
+                rows.append(row)
+
+        writer.write(rows)
+        write_finished_pdfs(pdf_jobs)
+        summary["images"] += len(batch)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            batch, pdf_jobs = [], deque()
+            for item in _prepared(pool, paths, bool(pdf_dir), window=2 * max(workers, batch_size)):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush(pool, batch, pdf_jobs)
+                    batch = []
+                    done = summary["images"]
+                    rate = done / (time.perf_counter() - started)
+                    print(f"\r{done}/{len(paths)} images, {rate:.1f} img/s", end="", flush=True)
+            if batch:
+                flush(pool, batch, pdf_jobs)
+            write_finished_pdfs(pdf_jobs, wait=True)
+    finally:
+        writer.close()
+
+    summary["seconds"] = time.perf_counter() - started
+    summary["images_per_second"] = summary["images"] / summary["seconds"] if summary["seconds"] else 0.0
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m report_utils",
+                                     description="Headless diabetic retinopathy screening")
+    parser.add_argument("source", help="image directory, or a .txt/.csv manifest")
+    parser.add_argument("--output", default="screening_results.jsonl",
+                        help=".jsonl or .csv; appended to, and used to resume")
+    parser.add_argument("--pdf-dir", help="also write one PDF report per image here")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="preprocessing processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=ru.MAX_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be >= 1")
+    if not os.path.exists(args.model):
+        parser.error(f"model checkpoint not found: {args.model}")
+    # library modules log model loads and storage failures
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    paths = list_images(args.source)
+    done = completed_paths(args.output)
+    todo = [p for p in paths if p not in done]
+    print(f"{len(paths)} images, {len(paths) - len(todo)} already screened, {len(todo)} to go")
+    if not todo:
+        return 0
+
+    summary = screen(todo, args.output, args.model, args.pdf_dir, args.workers, args.batch_size)
+    print(f"\nscreened {summary['images']} images in {summary['seconds']:.1f}s "
+          f"({summary['images_per_second']:.1f} img/s, "
+          f"inference {summary['inference_seconds']:.1f}s), "
+          f"{summary['pdfs']} PDFs, {summary['errors']} errors -> {args.output}")
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,592 @@
+# ============================
+# BENCHMARKS — report_utils HOT PATH
+# ============================
+# Usage:
+#   python benchmark.py preprocess [--repeats N]
+#   python benchmark.py decode [--repeats N]
+#   python benchmark.py pdf [--repeats N]
+#   python benchmark.py imports            (exits 1 if over IMPORT_BUDGET_MS)
+#   python benchmark.py hotpath [--repeats N] [--output results.json]
+#                               [--baseline baseline.json] [--tolerance 0.10]
+#   python benchmark.py compare results.json baseline.json [--tolerance 0.10]
+#   python benchmark.py history [--records 100000]
+#   python benchmark.py near-duplicates [--hashes 1000000] [--repeats N]
+#
+# hotpath needs no download: it benchmarks a randomly initialised
+# EfficientNet-B3 with the real 5-class head on synthetic fundus images.
+# With --baseline (or in compare mode) it exits 1 if any stage regressed.
+
+import sys
+import io
+import os
+import time
+import subprocess
+import json
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import report_utils as ru
+from atomic_files import atomic_write
+from instrumentation import peak_rss_bytes
+
+RESOLUTIONS = [(1024, 768), (2048, 1536), (3888, 2592)]
+
+# a stage regresses when its p50 latency or peak memory grows by more than this
+REGRESSION_TOLERANCE = 0.10
+
+# what pages/Reports.py imports at the top of every script run
+PAGE_IMPORTS = ["report_utils", "inference_scheduler", "result_cache", "inference_service", "model_download",
+                "analysis_jobs", "admission", "history_store", "artifact_store",
+                "near_duplicates"]
+IMPORT_BUDGET_MS = 50.0
+
+
+def synthetic_fundus(width, height, seed=0, blur=False):
+    """Fundus-like test image (BGR): dark border, orange disc, vessels, optic disc, noise."""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((height, width, 3), np.uint8)
+    cx, cy, r = width // 2, height // 2, int(min(width, height) * 0.47)
+    cv2.circle(img, (cx, cy), r, (30, 70, 170), -1)
+    cv2.circle(img, (cx + r // 3, cy), r // 7, (120, 190, 240), -1)
+
+    for _ in range(14):
+        pts = [(cx + r // 3, cy)]
+        angle = rng.uniform(0, 2 * np.pi)
+        for _ in range(6):
+            angle += rng.normal(0, 0.35)
+            step = r / 6
+            x, y = pts[-1]
+            pts.append((int(x + step * np.cos(angle)), int(y + step * np.sin(angle))))
+        cv2.polylines(img, [np.array(pts, np.int32)], False, (20, 30, 110), max(2, r // 120))
+
+    noise = rng.normal(0, 6, img.shape)
+    mask = np.zeros((height, width), np.uint8)
+    cv2.circle(mask, (cx, cy), r, 255, -1)
+    img = np.where(mask[..., None] > 0, np.clip(img + noise, 0, 255), 0).astype(np.uint8)
+
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), max(width, height) / 400)
+    return img
+
+
+def _time_ms(fn, repeats):
+    fn()  # warmup
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def bench_preprocess(repeats=20):
+    """Per-stage median latency: original functions vs PreprocessEngine, plus parity."""
+    engine = ru.preprocess_engine
+    rows = []
+    for width, height in RESOLUTIONS:
+        for blur in (False, True):
+            bgr = synthetic_fundus(width, height, blur=blur)
+            fundus = ru.preprocess_fundus(bgr)
+            enhanced = ru.deep_enhance(fundus)
+
+            stages = {
+                "fundus": (lambda: ru.preprocess_fundus(bgr), lambda: engine.fundus(bgr)),
+                "enhance": (lambda: ru.deep_enhance(fundus), lambda: engine.enhance(fundus)),
+                "to_tensor": (lambda: ru.to_tensor_image(enhanced), lambda: engine.to_tensor(enhanced)),
+            }
+            for stage, (old, new) in stages.items():
+                old_ms, new_ms = _time_ms(old, repeats), _time_ms(new, repeats)
+                rows.append({
+                    "resolution": f"{width}x{height}",
+                    "blurred": blur,
+                    "stage": stage,
+                    "original_ms": old_ms,
+                    "engine_ms": new_ms,
+                    "saving_pct": (1 - new_ms / old_ms) * 100 if old_ms else 0.0,
+                })
+
+            ref = ru.to_tensor_image(ru.deep_enhance(ru.preprocess_fundus(bgr)))
+            _, out = engine.run(bgr)
+            rows.append({
+                "resolution": f"{width}x{height}",
+                "blurred": blur,
+                "stage": "parity_max_abs_diff",
+                "value": (ref - out).abs().max().item(),
+            })
+    return rows
+
+
+def _peak_alloc_bytes(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_decode(repeats=20):
+    """Full-resolution decode vs decode_image (reduced, zero-copy) on camera-sized JPEGs."""
+    rows = []
+    for width, height in RESOLUTIONS:
+        _, enc = cv2.imencode(".jpg", synthetic_fundus(width, height), [cv2.IMWRITE_JPEG_QUALITY, 92])
+        data = enc.tobytes()
+
+        def original():
+            return cv2.imdecode(np.asarray(bytearray(data), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        def ingest():
+            return ru.decode_image(data)
+
+        old_ms, new_ms = _time_ms(original, repeats), _time_ms(ingest, repeats)
+        rows.append({
+            "resolution": f"{width}x{height}",
+            "blurred": False,
+            "stage": "decode",
+            "original_ms": old_ms,
+            "engine_ms": new_ms,
+            "saving_pct": (1 - new_ms / old_ms) * 100 if old_ms else 0.0,
+        })
+        rows.append({
+            "resolution": f"{width}x{height}",
+            "blurred": False,
+            "stage": "decode_peak_MiB",
+            "value": _peak_alloc_bytes(original) / 2**20,
+        })
+        rows.append({
+            "resolution": f"{width}x{height}",
+            "blurred": False,
+            "stage": "ingest_peak_MiB",
+            "value": _peak_alloc_bytes(ingest) / 2**20,
+        })
+    return rows
+
+
+def bench_pdf(repeats=20):
+    """PDFs/second per stage: per-call story construction with ASCII85 images vs cached templates."""
+    from reportlab import rl_config
+
+    jpg = ru.report_image_buffer(synthetic_fundus(1024, 768)).getvalue()
+    rows = []
+    for cls in sorted(ru.get_pdf_templates()):
+        def uncached():
+            return ru.generate_pdf(io.BytesIO(jpg), io.BytesIO(jpg), cls, 0.87,
+                                   template=ru.PdfTemplate(cls))
+
+        def cached():
+            return ru.generate_pdf(io.BytesIO(jpg), io.BytesIO(jpg), cls, 0.87)
+
+        use_a85 = rl_config.useA85
+        try:
+            rl_config.useA85 = 1
+            old_ms = _time_ms(uncached, repeats)
+        finally:
+            rl_config.useA85 = use_a85
+        new_ms = _time_ms(cached, repeats)
+
+        rows.append({
+            "resolution": f"stage {cls}",
+            "stage": "generate_pdf",
+            "original_ms": old_ms,
+            "engine_ms": new_ms,
+            "saving_pct": (1 - new_ms / old_ms) * 100 if old_ms else 0.0,
+        })
+        rows.append({
+            "resolution": f"stage {cls}",
+            "stage": "pdfs_per_sec",
+            "value": 1000.0 / new_ms,
+        })
+    return rows
+
+
+def _importtime(code):
+    """Run code in a fresh interpreter under -X importtime; {module: cumulative_us}."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=here, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line.split(":", 1)[1].split("|")
+        cumulative[name.strip()] = int(cum_us)
+    return cumulative
+
+
+def bench_imports(top=10):
+    """Import-time breakdown of the page imports, checked against IMPORT_BUDGET_MS."""
+    cumulative = _importtime("import " + ", ".join(PAGE_IMPORTS))
+    total_ms = sum(cumulative.get(m, 0) for m in PAGE_IMPORTS) / 1000.0
+
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for name, us in sorted(cumulative.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"{name:<40} {us / 1000.0:14.1f}")
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ("import time; t = time.perf_counter(); import report_utils; "
+            "report_utils.prewarm(background=False); print((time.perf_counter() - t) * 1000)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+    heavy_ms = float(out.stdout.strip().splitlines()[-1])
+
+    print(f"\npage imports: {total_ms:.1f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    print(f"deferred to first use / prewarm(): {heavy_ms:.0f} ms")
+    return total_ms <= IMPORT_BUDGET_MS
+
+
+# =======================================
+# HOT PATH SUITE (p50/p95, throughput, peak memory, JSON + baseline compare)
+# =======================================
+
+def random_checkpoint(path=None, seed=0):
+    """State dict of a randomly initialised EfficientNet-B3 with the 5-class head."""
+    path = path or os.path.join(tempfile.gettempdir(), f"dr_bench_effnet_b3_seed{seed}.pt")
+    if not os.path.exists(path):
+        import torch
+        from torchvision import models
+
+        torch.manual_seed(seed)
+        model = models.efficientnet_b3(weights=None)
+        model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, 5)
+        state_dict = model.state_dict()
+        atomic_write(path, lambda tmp: torch.save(state_dict, tmp))
+    return path
+
+
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def measure(fn, repeats):
+    """p50/p95 latency and throughput over repeats calls, plus traced peak allocation of one call."""
+    fn()  # warmup
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    # Python/NumPy/OpenCV allocations; torch's CPU allocator is not traced
+    peak = _peak_alloc_bytes(fn)
+    return {
+        "p50_ms": _percentile(samples, 0.50),
+        "p95_ms": _percentile(samples, 0.95),
+        "throughput_per_s": 1000.0 * len(samples) / sum(samples),
+        "peak_MiB": peak / 2**20,
+    }
+
+
+def bench_hotpath(repeats=20, model_path=None):
+    """{"<stage>@<resolution>": measure(...)} for each public hot-path function and run_pipeline."""
+    model_path = model_path or random_checkpoint()
+    model, class_names = ru.get_model(model_path)
+    results = {}
+
+    for width, height in RESOLUTIONS:
+        res = f"{width}x{height}"
+        bgr = synthetic_fundus(width, height)
+        _, enc = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        data = enc.tobytes()
+        fundus = ru.preprocess_fundus(bgr)
+        enhanced = ru.deep_enhance(fundus)
+
+        results[f"preprocess_fundus@{res}"] = measure(lambda: ru.preprocess_fundus(bgr), repeats)
+        results[f"deep_enhance@{res}"] = measure(lambda: ru.deep_enhance(fundus), repeats)
+        results[f"to_tensor_image@{res}"] = measure(lambda: ru.to_tensor_image(enhanced), repeats)
+        results[f"run_pipeline@{res}"] = measure(lambda: ru.run_pipeline(data, model_path), repeats)
+
+    # fixed model input / report image size: resolution independent
+    enhanced = ru.deep_enhance(ru.preprocess_fundus(synthetic_fundus(*RESOLUTIONS[0])))
+    tensor = ru.to_tensor_image(enhanced)
+    jpg = ru.report_image_buffer(enhanced, rgb=True).getvalue()
+    results["predict"] = measure(lambda: ru.predict(model, tensor, class_names), repeats)
+    results["generate_pdf"] = measure(
+        lambda: ru.generate_pdf(io.BytesIO(jpg), io.BytesIO(jpg), 2, 0.87), repeats
+    )
+    return results
+
+
+def environment():
+    import torch
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "opencv": cv2.__version__,
+        "inference_backend": ru.INFERENCE_BACKEND,
+        "quantization": ru.QUANTIZATION,
+    }
+
+
+def compare(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Rows for stages present in both runs; "regressed" is set when p50 or peak memory grew past tolerance."""
+    rows = []
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        row = {"stage": name, "old_p50_ms": old["p50_ms"], "new_p50_ms": new["p50_ms"],
+               "old_peak_MiB": old["peak_MiB"], "new_peak_MiB": new["peak_MiB"]}
+        row["p50_change"] = new["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+        # ignore memory noise below 1 MiB
+        row["peak_change"] = (new["peak_MiB"] / old["peak_MiB"] - 1) if old["peak_MiB"] >= 1 else 0.0
+        row["regressed"] = row["p50_change"] > tolerance or row["peak_change"] > tolerance
+        rows.append(row)
+    return rows
+
+
+def print_hotpath(results):
+    print(f"{'stage':<32} {'p50 ms':>10} {'p95 ms':>10} {'per s':>10} {'peak MiB':>10}")
+    for name, r in results.items():
+        print(f"{name:<32} {r['p50_ms']:10.2f} {r['p95_ms']:10.2f} "
+              f"{r['throughput_per_s']:10.1f} {r['peak_MiB']:10.1f}")
+
+
+def print_comparison(rows):
+    print(f"{'stage':<32} {'p50 ms':>20} {'peak MiB':>18}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(f"{row['stage']:<32} {row['old_p50_ms']:8.2f} -> {row['new_p50_ms']:8.2f} "
+              f"{row['old_peak_MiB']:7.1f} -> {row['new_peak_MiB']:7.1f} "
+              f"({row['p50_change']:+.0%}){flag}")
+    return not any(row["regressed"] for row in rows)
+
+
+def _load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_rows(rows):
+    for row in rows:
+        label = row["resolution"]
+        if "blurred" in row:
+            label += f" blur={row['blurred']!s:<5}"
+        if "value" in row:
+            print(f"{label:>22} {row['stage']:<20} {row['value']:.2e}")
+        else:
+            print(f"{label:>22} {row['stage']:<20} "
+                  f"{row['original_ms']:8.2f} ms -> {row['engine_ms']:8.2f} ms  ({row['saving_pct']:+.1f}%)")
+
+
+def bench_history(records=100_000, page_size=None, path=None):
+    """Insert records uploads into a fresh history store and page through them."""
+    from history_store import HistoryStore, PAGE_SIZE
+
+    page_size = page_size or PAGE_SIZE
+    path = path or os.path.join(tempfile.mkdtemp(prefix="dr_bench_history_"), "history.sqlite3")
+    store = HistoryStore(path)
+    rng = np.random.default_rng(0)
+    user = "clinician@example.com"
+    stages = ["No DR", "Mild", "Moderate", "Severe", "Proliferative DR"]
+    span_s = 3 * 365 * 86400.0
+    start = time.time() - span_s
+
+    def row(i):
+        # 90% of uploads belong to the one busy clinician being paged
+        email = user if rng.random() < 0.9 else f"other{rng.integers(9)}@example.com"
+        stage = stages[rng.choice(5, p=[0.70, 0.12, 0.10, 0.05, 0.03])]
+        return (email, start + span_s * i / records, f"fundus_{i}.jpg", stage,
+                float(rng.uniform(0.5, 1.0)), None)
+
+    results = {"records": records, "page_size": page_size}
+
+    # one add() per upload, as the Reports page writes them
+    singles = min(1000, records)
+    samples = []
+    for i in range(singles):
+        email, created_at, filename, stage, confidence, _ = row(i)
+        t0 = time.perf_counter()
+        store.add(email, filename, stage, confidence, created_at=created_at)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    results["insert_ms_p50"] = _percentile(samples, 0.50) * 1000.0
+    results["insert_ms_p95"] = _percentile(samples, 0.95) * 1000.0
+
+    t0 = time.perf_counter()
+    for chunk in range(singles, records, 10_000):
+        store.add_many([row(i) for i in range(chunk, min(chunk + 10_000, records))])
+    bulk = records - singles
+    results["bulk_insert_rows_per_s"] = bulk / (time.perf_counter() - t0) if bulk else 0.0
+    results["user_rows"] = store.count(user)
+
+    def walk(**filters):
+        pages, rows, cursor, samples = 0, 0, None, []
+        while True:
+            t0 = time.perf_counter()
+            page, cursor = store.page(user, cursor, page_size, **filters)
+            samples.append(time.perf_counter() - t0)
+            pages, rows = pages + 1, rows + len(page)
+            if cursor is None:
+                break
+        samples.sort()
+        return {"pages": pages, "rows": rows,
+                "page_ms_p50": _percentile(samples, 0.50) * 1000.0,
+                "page_ms_p95": _percentile(samples, 0.95) * 1000.0,
+                "page_ms_max": samples[-1] * 1000.0,
+                "total_s": sum(samples)}
+
+    end = start + span_s
+    results["walks"] = {
+        "all": walk(),
+        "stage=Severe": walk(stages=["Severe"]),
+        "stage=Mild|Moderate": walk(stages=["Mild", "Moderate"]),
+        "last 30 days": walk(since=end - 30 * 86400.0, until=end),
+    }
+
+    # for contrast: the last page by OFFSET, which scans every row before it
+    db = store._connect()
+    t0 = time.perf_counter()
+    db.execute("SELECT id FROM uploads WHERE user_email = ? ORDER BY created_at DESC, id DESC"
+               " LIMIT ? OFFSET ?", (user, page_size, max(results["user_rows"] - page_size, 0))).fetchall()
+    results["offset_last_page_ms"] = (time.perf_counter() - t0) * 1000.0
+    results["db_MiB"] = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal")
+                            if os.path.exists(path + suffix)) / 2**20
+    store.close()
+    return results
+
+
+def print_history(results):
+    print(f"{results['records']} records ({results['user_rows']} for the paged user), "
+          f"{results['db_MiB']:.1f} MiB")
+    print(f"insert: {results['insert_ms_p50']:.3f} ms p50, {results['insert_ms_p95']:.3f} ms p95 per add(); "
+          f"bulk {results['bulk_insert_rows_per_s']:,.0f} rows/s")
+    print(f"{'walk':<22} {'pages':>6} {'rows':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'total s':>8}")
+    for name, w in results["walks"].items():
+        print(f"{name:<22} {w['pages']:>6} {w['rows']:>7} {w['page_ms_p50']:8.3f} {w['page_ms_p95']:8.3f} "
+              f"{w['page_ms_max']:8.3f} {w['total_s']:8.2f}")
+    print(f"last page by OFFSET instead: {results['offset_last_page_ms']:.2f} ms")
+
+
+def bench_near_duplicates(hashes=1_000_000, queries=20_000, repeats=20):
+    """Multi-index lookups against hashes random 64-bit hashes, vs a NumPy linear scan."""
+    from near_duplicates import MultiIndexHash, NEAR_DUPLICATE_DISTANCE, perceptual_hash, confirm
+
+    rng = np.random.default_rng(0)
+    stored = rng.integers(0, 2**63, size=hashes, dtype=np.uint64) * np.uint64(2) \
+        + rng.integers(0, 2, size=hashes, dtype=np.uint64)
+    values = [int(h) for h in stored]
+    r = NEAR_DUPLICATE_DISTANCE
+    results = {"hashes": hashes, "max_distance": r}
+
+    rss_before = peak_rss_bytes()
+    index = MultiIndexHash(r)
+    t0 = time.perf_counter()
+    index.add_many(values, range(hashes))
+    results["build_s"] = time.perf_counter() - t0
+    results["build_peak_rss_growth_MiB"] = (peak_rss_bytes() - rss_before) / 2**20
+
+    # one add() per analysis, including the periodic rebuilds it triggers
+    extra = [int(h) for h in rng.integers(0, 2**63, size=queries, dtype=np.uint64)]
+    t0 = time.perf_counter()
+    for i, h in enumerate(extra):
+        index.add(h, hashes + i)
+    results["add_us"] = (time.perf_counter() - t0) / len(extra) * 1e6
+
+    def near(h):
+        # a stored hash with up to r random bits flipped
+        for bit in rng.choice(64, size=rng.integers(0, r + 1), replace=False):
+            h ^= 1 << int(bit)
+        return h
+
+    picks = rng.integers(0, hashes, size=queries)
+    hit_queries = [near(values[i]) for i in picks]
+    miss_queries = [int(h) for h in rng.integers(0, 2**63, size=queries, dtype=np.uint64)]
+
+    def run(batch):
+        samples, found = [], 0
+        for q in batch:
+            t0 = time.perf_counter()
+            found += bool(index.search(q))
+            samples.append(time.perf_counter() - t0)
+        samples.sort()
+        return {"lookups_per_s": len(batch) / sum(samples),
+                "us_p50": _percentile(samples, 0.50) * 1e6,
+                "us_p95": _percentile(samples, 0.95) * 1e6,
+                "found": found / len(batch)}
+
+    results["near"] = run(hit_queries)
+    results["random"] = run(miss_queries)
+
+    # baseline: XOR + popcount over every stored hash
+    probe = np.uint64(hit_queries[0])
+    results["linear_scan_ms"] = _time_ms(lambda: np.flatnonzero(np.bitwise_count(stored ^ probe) <= r), repeats)
+
+    bgr = synthetic_fundus(2048, 1536)
+    fundus = ru.preprocess_fundus(bgr)
+    results["hash_us"] = _time_ms(lambda: perceptual_hash(fundus), repeats) * 1000.0
+    # every candidate is checked against its stored original report image
+    original_jpeg = ru.report_image_buffer(bgr).getvalue()
+    results["confirm_ms"] = _time_ms(lambda: confirm(fundus, original_jpeg), repeats)
+    return results
+
+
+def print_near_duplicates(results):
+    print(f"{results['hashes']:,} stored hashes, radius {results['max_distance']}: "
+          f"built in {results['build_s']:.1f}s, +{results['build_peak_rss_growth_MiB']:.0f} MiB peak RSS, "
+          f"{results['add_us']:.1f} us per add()")
+    for name in ("near", "random"):
+        q = results[name]
+        print(f"{name:>7} queries: {q['lookups_per_s']:,.0f} lookups/s, {q['us_p50']:.1f} us p50, "
+              f"{q['us_p95']:.1f} us p95, {q['found']:.0%} found")
+    print(f"linear NumPy scan: {results['linear_scan_ms']:.2f} ms per lookup")
+    print(f"perceptual_hash: {results['hash_us']:.0f} us per image")
+    print(f"confirm: {results['confirm_ms']:.1f} ms per candidate")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="report_utils benchmarks")
+    parser.add_argument("suite", choices=["preprocess", "decode", "pdf", "imports", "hotpath", "compare", "history",
+                                          "near-duplicates"])
+    parser.add_argument("files", nargs="*", help="compare: RESULTS BASELINE")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--model", help="checkpoint for hotpath (default: random EfficientNet-B3)")
+    parser.add_argument("--output", help="hotpath: write results JSON here")
+    parser.add_argument("--baseline", help="hotpath: compare against this results JSON")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--records", type=int, default=100_000, help="history: rows to insert")
+    parser.add_argument("--hashes", type=int, default=1_000_000, help="near-duplicates: hashes to index")
+    args = parser.parse_args(argv)
+
+    if args.suite == "preprocess":
+        print_rows(bench_preprocess(args.repeats))
+    elif args.suite == "decode":
+        print_rows(bench_decode(args.repeats))
+    elif args.suite == "pdf":
+        print_rows(bench_pdf(args.repeats))
+    elif args.suite == "imports":
+        return 0 if bench_imports() else 1
+    elif args.suite == "hotpath":
+        results = {"environment": environment(), "results": bench_hotpath(args.repeats, args.model)}
+        results["environment"]["peak_rss_MiB"] = peak_rss_bytes() / 2**20
+        print_hotpath(results["results"])
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            print()
+            return 0 if print_comparison(compare(results, _load_json(args.baseline), args.tolerance)) else 1
+    elif args.suite == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs RESULTS and BASELINE")
+        current, baseline = (_load_json(p) for p in args.files)
+        return 0 if print_comparison(compare(current, baseline, args.tolerance)) else 1
+    elif args.suite == "history":
+        print_history(bench_history(args.records))
+    elif args.suite == "near-duplicates":
+        print_near_duplicates(bench_near_duplicates(args.hashes, repeats=args.repeats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
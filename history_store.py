@@ -0,0 +1,161 @@
+# ============================
+# PERSISTENT UPLOAD HISTORY
+# ============================
+# One row per analysed upload in a local SQLite database (DR_HISTORY_DB),
+# written by the Reports page and read a page at a time by the History
+# page, so history survives reloads and restarts and a user with years of
+# screenings costs no more to show than one with ten.
+#
+# - WAL journal: the History page reads while Reports sessions write
+# - (user_email, created_at, id) and (user_email, stage, created_at, id)
+#   indexes, plus created_at for clinic-wide queries
+# - keyset pagination: page() returns a cursor (created_at, id) for the
+#   next (older) page, so page 1000 is as cheap as page 1, unlike OFFSET
+# - each row keeps the upload's perceptual hash, from which
+#   near_duplicates.py builds one user's index on their first lookup
+#
+# Connections are per thread (sqlite3 objects must not cross threads);
+# all threads share the one database file.
+
+import os
+import time
+import sqlite3
+import threading
+
+HISTORY_DB = os.environ.get("DR_HISTORY_DB", "upload_history.sqlite3")
+PAGE_SIZE = 25
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY,
+    user_email TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    filename TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    result_key TEXT,
+    phash TEXT
+);
+CREATE INDEX IF NOT EXISTS uploads_user_time ON uploads (user_email, created_at, id);
+CREATE INDEX IF NOT EXISTS uploads_user_stage_time ON uploads (user_email, stage, created_at, id);
+CREATE INDEX IF NOT EXISTS uploads_time ON uploads (created_at);
+"""
+
+_COLUMNS = "id, user_email, created_at, filename, stage, confidence, result_key"
+# added after the first release; older databases get it on open
+_MIGRATIONS = {"phash": "ALTER TABLE uploads ADD COLUMN phash TEXT"}
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(uploads)")}
+            for column, sql in _MIGRATIONS.items():
+                if column not in columns:
+                    db.execute(sql)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: durable across app crashes, one fsync per checkpoint
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # ---------- writes ----------
+
+    def add(self, user_email, filename, stage, confidence, result_key=None, created_at=None, phash=None):
+        """Record one analysed upload; returns its row id. phash is its 64-bit perceptual hash."""
+        with self._connect() as db:
+            cur = db.execute(
+                "INSERT INTO uploads (user_email, created_at, filename, stage, confidence, result_key, phash)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_email, created_at if created_at is not None else time.time(),
+                 filename, stage, confidence, result_key,
+                 f"{phash:016x}" if phash is not None else None),
+            )
+            return cur.lastrowid
+
+    def add_many(self, rows):
+        """Bulk insert (user_email, created_at, filename, stage, confidence, result_key) tuples."""
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO uploads (user_email, created_at, filename, stage, confidence, result_key)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    # ---------- reads ----------
+
+    def page(self, user_email, cursor=None, limit=PAGE_SIZE, since=None, until=None, stages=None):
+        """
+        Newest-first uploads of user_email, at most limit of them, older than
+        cursor (from a previous call) and within [since, until) epoch seconds
+        and stages if given. Returns (rows, next_cursor); next_cursor is None
+        on the last page.
+        """
+        where, args = ["user_email = ?"], [user_email]
+        if cursor is not None:
+            where.append("(created_at, id) < (?, ?)")
+            args.extend(cursor)
+        if since is not None:
+            where.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            args.append(until)
+        if stages:
+            where.append(f"stage IN ({', '.join('?' * len(stages))})")
+            args.extend(stages)
+
+        # one row past the page tells whether there is a next one
+        sql = (f"SELECT {_COLUMNS} FROM uploads WHERE {' AND '.join(where)}"
+               " ORDER BY created_at DESC, id DESC LIMIT ?")
+        rows = [dict(r) for r in self._connect().execute(sql, args + [limit + 1])]
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            return rows, (last["created_at"], last["id"])
+        return rows, None
+
+    def phashes(self, user_email):
+        """[(phash, result_key)] of user_email's uploads that have both, oldest first."""
+        rows = self._connect().execute(
+            "SELECT phash, result_key FROM uploads"
+            " WHERE user_email = ? AND phash IS NOT NULL AND result_key IS NOT NULL"
+            " ORDER BY created_at, id",
+            (user_email,),
+        )
+        return [(int(phash, 16), key) for phash, key in rows]
+
+    def count(self, user_email):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM uploads WHERE user_email = ?", (user_email,)
+        ).fetchone()
+        return row[0]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_history_store(path=HISTORY_DB):
+    """Process-wide store per database path, shared by every session."""
+    with _STORES_LOCK:
+        store = _STORES.get(path)
+        if store is None:
+            store = HistoryStore(path)
+            _STORES[path] = store
+        return store
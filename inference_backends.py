@@ -0,0 +1,133 @@
+# ============================
+# SELECTABLE INFERENCE BACKENDS
+# ============================
+# Wraps the eager EfficientNet-B3 module in an alternative runtime:
+#   "eager"       — plain torch.nn.Module (default)
+#   "torchscript" — traced, frozen and optimized for inference
+#   "compile"     — torch.compile (inductor)
+#   "onnx"        — exported ONNX graph run by ONNX Runtime on CPU
+#                   (needs the optional onnxruntime package)
+#
+# Exported artifacts are cached on disk next to the checkpoint, named by
+# the checkpoint hash, the quantization mode and the torch version that
+# exported them (an FP32 and an INT8 graph of one checkpoint are different
+# files, and a torch upgrade re-exports). Every backend is checked against
+# eager on a probe input after it is built; if building fails or outputs
+# drift beyond PARITY_ATOL, the eager model is used instead.
+
+import os
+import logging
+import warnings
+
+import numpy as np
+import torch
+
+from atomic_files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+
+# max allowed abs difference in softmax probabilities vs eager
+PARITY_ATOL = 1e-3
+
+
+class OnnxRuntimeModel:
+    """Callable with the same tensor-in / logits-tensor-out contract as the eager model."""
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            onnx_path, opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, tensor):
+        feed = {self.input_name: tensor.detach().cpu().numpy().astype(np.float32, copy=False)}
+        return torch.from_numpy(self.session.run(None, feed)[0])
+
+    def eval(self):
+        return self
+
+
+def artifact_path(model_path, sha256, backend, quantization=None):
+    stem = os.path.splitext(model_path)[0]
+    suffix = {"torchscript": ".torchscript.pt", "onnx": ".onnx"}[backend]
+    return f"{stem}.{sha256[:12]}.{quantization or 'fp32'}.torch{torch.__version__}{suffix}"
+
+
+def build_torchscript(model, example, path):
+    if not os.path.exists(path):
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced.eval())
+        atomic_write(path, lambda p: torch.jit.save(frozen, p))
+    # optimize_for_inference output does not round-trip through jit.save,
+    # so the frozen graph is cached and optimized after loading
+    return torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu").eval())
+
+
+def build_onnx(model, example, path):
+    if not os.path.exists(path):
+        def export(p):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                torch.onnx.export(
+                    model, (example,), p,
+                    input_names=["input"], output_names=["logits"],
+                    dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+                    opset_version=17, dynamo=False,
+                )
+        atomic_write(path, export)
+    return OnnxRuntimeModel(path)
+
+
+def build_compiled(model):
+    return torch.compile(model, dynamic=True)
+
+
+def check_parity(reference, candidate, example, atol=PARITY_ATOL):
+    """Return the max abs softmax difference between two models on example."""
+    with torch.no_grad():
+        ref = torch.softmax(reference(example), dim=1)
+        out = torch.softmax(candidate(example), dim=1)
+    drift = (ref - out).abs().max().item()
+    if drift > atol:
+        raise ValueError(f"backend output drifted {drift:.2e} from eager (atol {atol:.0e})")
+    return drift
+
+
+def build_backend(model, backend, model_path, sha256, input_size, quantization=None):
+    """
+    Wrap an eager eval-mode model in the requested backend. quantization is
+    the mode model was quantized with, so exports of different modes do not
+    share a file. Returns (runner, backend_used); falls back to
+    (model, "eager") on any failure.
+    """
+    if backend in (None, "", "eager"):
+        return model, "eager"
+    if backend not in BACKENDS:
+        logger.warning("Unknown inference backend %r; using eager", backend)
+        return model, "eager"
+
+    example = torch.rand(2, 3, input_size, input_size)
+    try:
+        if backend == "torchscript":
+            path = artifact_path(model_path, sha256, backend, quantization)
+            runner = build_torchscript(model, example, path)
+        elif backend == "onnx":
+            path = artifact_path(model_path, sha256, backend, quantization)
+            runner = build_onnx(model, example, path)
+        else:
+            runner = build_compiled(model)
+        check_parity(model, runner, example)
+    except Exception as e:
+        logger.warning("Inference backend %r unavailable (%s: %s); using eager", backend, type(e).__name__, e)
+        return model, "eager"
+
+    return runner, backend
@@ -0,0 +1,167 @@
+# ============================
+# DYNAMIC MICRO-BATCHING SCHEDULER
+# ============================
+# All Streamlit sessions share one scheduler: each session submits its
+# preprocessed tensor and blocks on a future, while a single worker thread
+# groups pending requests into micro-batches and runs them through the
+# shared model in one forward pass.
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from report_utils import get_model, predict_batch, torch
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_MAX_WAIT_MS = 20
+
+
+class _Request:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    def __init__(self, model_path, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, wait_window=1000):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._waits = deque(maxlen=wait_window)
+        self._batches = 0
+        self._requests = 0
+
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="inference-scheduler", daemon=True
+        )
+        self._worker.start()
+
+    # ---------- public API ----------
+
+    def submit(self, tensor):
+        """Queue a (1, 3, H, W) or (3, H, W) tensor; returns a Future of (cls, prob, probs)."""
+        if self._stopped.is_set():
+            raise RuntimeError("InferenceScheduler is shut down")
+        if tensor.dim() == 4:
+            tensor = tensor[0]
+        req = _Request(tensor)
+        self._queue.put(req)
+        return req.future
+
+    def predict(self, tensor, timeout=None):
+        return self.submit(tensor).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches = self._batches
+            requests = self._requests
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000.0
+
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "wait_ms_mean": (sum(waits) / len(waits) * 1000.0) if waits else 0.0,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": waits[-1] * 1000.0 if waits else 0.0,
+        }
+
+    # ---------- worker ----------
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                req = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                self._stopped.set()
+                break
+            batch.append(req)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = self._collect(first)
+            started = time.perf_counter()
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+
+            if batch:
+                try:
+                    model, class_names = get_model(self.model_path)
+                    tensor = torch.stack([r.tensor for r in batch])
+                    results = predict_batch(model, tensor, class_names)
+                except Exception as e:
+                    for r in batch:
+                        r.future.set_exception(e)
+                else:
+                    for r, res in zip(batch, results):
+                        r.future.set_result(res)
+
+                with self._stats_lock:
+                    self._batches += 1
+                    self._requests += len(batch)
+                    self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+                    self._waits.extend(started - r.enqueued_at for r in batch)
+
+            if self._stopped.is_set():
+                break
+
+        # fail anything still queued after shutdown
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is not None and req.future.set_running_or_notify_cancel():
+                req.future.set_exception(RuntimeError("InferenceScheduler is shut down"))
+
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(model_path, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    """Process-wide scheduler per checkpoint path, shared by every session."""
+    with _SCHEDULERS_LOCK:
+        sched = _SCHEDULERS.get(model_path)
+        if sched is None:
+            sched = InferenceScheduler(model_path, max_batch_size, max_wait_ms)
+            _SCHEDULERS[model_path] = sched
+        return sched
@@ -0,0 +1,415 @@
+# ============================
+# STANDALONE INFERENCE SERVICE
+# ============================
+# Moves load_model / predict / generate_pdf out of the Streamlit process:
+#
+#   python inference_service.py --model efficientnet_b3_state_dict.pt \
+#          [--workers 2] [--threads N] [--prefork] [--host 127.0.0.1] [--port 8600]
+#
+# A threaded HTTP server hands each request to a pool of worker processes,
+# each with torch.set_num_threads(threads) so workers do not oversubscribe
+# the cores. By default every worker loads its own model; with --prefork
+# (Linux/macOS) the parent loads it once, moves its parameters and buffers
+# into shared memory and forks the workers, which find it already in their
+# inherited model registry, so N workers hold one copy of the weights.
+# /health reports each process's unique (USS) and proportional (PSS)
+# memory to verify the sharing. Pages talk to it through InferenceClient
+# when DR_INFERENCE_URL is set (e.g. http://127.0.0.1:8600), so UI replicas
+# and inference workers scale independently on the same box.
+#
+#   POST /analyze        body: image bytes -> JSON {cls, prob, report_id,
+#                        model_version, timings}
+#   GET  /report/<id>    PDF for an earlier /analyze (rendered on first GET)
+#   GET  /health         JSON {status, workers, model_version, memory}
+#   GET  /metrics        Prometheus text of per-stage timings
+
+import os
+import sys
+import json
+import uuid
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+
+INFERENCE_URL = os.environ.get("DR_INFERENCE_URL") or None
+DEFAULT_PORT = 8600
+REQUEST_TIMEOUT_S = 120
+# reports kept for /report/<id> after /analyze (two ~30 KB JPEGs each, or the PDF)
+REPORT_SLOTS = 512
+
+
+# =======================================
+# WORKER PROCESSES
+# =======================================
+
+_WORKER_MODEL_PATH = None
+
+
+def _init_worker(model_path, threads):
+    global _WORKER_MODEL_PATH
+    import report_utils as ru
+
+    _WORKER_MODEL_PATH = model_path
+    ru.torch.set_num_threads(threads)
+    ru.cv2.setNumThreads(1)
+    ru.get_model(model_path)
+    ru.get_pdf_templates()
+
+
+def _analyze(image_bytes):
+    """Worker: run_pipeline without the PDF; returns the report inputs alongside."""
+    from report_utils import run_pipeline
+
+    cls, prob, report, timings = run_pipeline(
+        image_bytes, _WORKER_MODEL_PATH, defer_pdf=True, return_timings=True
+    )
+    return cls, prob, timings, report.original_jpeg, report.processed_jpeg
+
+
+def _render(original_jpeg, processed_jpeg, cls, prob):
+    from report_utils import DeferredReport
+    return DeferredReport(original_jpeg, processed_jpeg, cls, prob).get()
+
+
+# =======================================
+# SHARED WEIGHTS + MEMORY ACCOUNTING
+# =======================================
+
+def share_model_memory(model):
+    """Move an nn.Module's parameters and buffers into shared memory; returns bytes shared."""
+    import torch
+
+    if not isinstance(model, torch.nn.Module):
+        return 0  # e.g. the ONNX Runtime backend: fork still shares it copy-on-write
+    model.share_memory()
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def process_memory(pid="self"):
+    """
+    {rss, pss, uss, shared} in bytes from /proc/<pid>/smaps_rollup. uss
+    (private pages) is what a process costs on its own; pages it shares
+    with the other workers count towards shared and, split, towards pss.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[0].endswith(":"):
+                    fields[parts[0][:-1]] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+# =======================================
+# SERVER
+# =======================================
+
+class InferenceService:
+    def __init__(self, model_path, workers=2, threads=None, prefork=False):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from report_utils import model_version
+
+        self.model_path = os.path.abspath(model_path)
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.prefork = prefork
+        self.shared_bytes = 0
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+
+        context = None
+        if prefork:
+            import report_utils as ru
+
+            model, _ = ru.get_model(self.model_path)
+            ru.get_pdf_templates()
+            self.shared_bytes = share_model_memory(model)
+            context = multiprocessing.get_context("fork")
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(self.model_path, self.threads),
+        )
+        # spawn the workers (each loads its model) before accepting traffic;
+        # the version names the backend the workers' model actually runs
+        versions = {f.result() for f in [self._pool.submit(model_version, self.model_path)
+                                          for _ in range(workers)]}
+        self.model_version = versions.pop()
+
+    def analyze(self, image_bytes):
+        from instrumentation import record
+
+        cls, prob, timings, original_jpeg, processed_jpeg = self._pool.submit(
+            _analyze, image_bytes
+        ).result(timeout=REQUEST_TIMEOUT_S)
+        for stage, seconds in timings.items():
+            record(stage, seconds)
+
+        report_id = uuid.uuid4().hex
+        with self._lock:
+            self._reports[report_id] = (original_jpeg, processed_jpeg, cls, prob, None)
+            while len(self._reports) > REPORT_SLOTS:
+                self._reports.popitem(last=False)
+        return {
+            "cls": cls,
+            "prob": prob,
+            "report_id": report_id,
+            "model_version": self.model_version,
+            "timings": timings,
+        }
+
+    def report(self, report_id):
+        """PDF bytes, or None if report_id is unknown or evicted."""
+        with self._lock:
+            entry = self._reports.get(report_id)
+            if entry is None:
+                return None
+            self._reports.move_to_end(report_id)
+        original_jpeg, processed_jpeg, cls, prob, pdf = entry
+        if pdf is None:
+            pdf = self._pool.submit(_render, original_jpeg, processed_jpeg, cls, prob).result(
+                timeout=REQUEST_TIMEOUT_S
+            )
+            with self._lock:
+                if report_id in self._reports:
+                    self._reports[report_id] = (None, None, cls, prob, pdf)
+        return pdf
+
+    def memory(self):
+        """process_memory() of the server and of each worker process."""
+        # ProcessPoolExecutor has no public way to list its worker pids
+        pids = sorted(getattr(self._pool, "_processes", None) or {})
+        return {
+            "server": process_memory(),
+            "workers": {str(pid): process_memory(pid) for pid in pids},
+            "shared_weight_bytes": self.shared_bytes,
+        }
+
+    def health(self):
+        return {"status": "ok", "workers": self.workers, "threads_per_worker": self.threads,
+                "prefork": self.prefork, "model_version": self.model_version,
+                "memory": self.memory()}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def make_handler(service):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="application/json"):
+            if not isinstance(body, (bytes, bytearray)):
+                body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/analyze":
+                return self._send(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0:
+                return self._send(400, {"error": "empty body"})
+            image_bytes = self.rfile.read(length)
+            try:
+                self._send(200, service.analyze(image_bytes))
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def do_GET(self):
+            if self.path == "/health":
+                return self._send(200, service.health())
+            if self.path == "/metrics":
+                from instrumentation import to_prometheus
+                return self._send(200, to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+            if self.path.startswith("/report/"):
+                try:
+                    pdf = service.report(self.path[len("/report/"):])
+                except Exception as e:
+                    return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+                if pdf is None:
+                    return self._send(404, {"error": "unknown or expired report"})
+                return self._send(200, pdf, "application/pdf")
+            self._send(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def print_memory(memory):
+    mib = 2**20
+    print(f"{'process':>10} {'rss MiB':>9} {'pss MiB':>9} {'unique MiB':>11} {'shared MiB':>11}")
+    rows = [("server", memory["server"])] + sorted(memory["workers"].items())
+    for name, m in rows:
+        if m is not None:
+            print(f"{name:>10} {m['rss'] / mib:9.0f} {m['pss'] / mib:9.0f} "
+                  f"{m['uss'] / mib:11.0f} {m['shared'] / mib:11.0f}")
+    if memory["shared_weight_bytes"]:
+        print(f"model weights in shared memory: {memory['shared_weight_bytes'] / mib:.0f} MiB")
+
+
+def serve(model_path, host="127.0.0.1", port=DEFAULT_PORT, workers=2, threads=None, prefork=False):
+    from http.server import ThreadingHTTPServer
+    import instrumentation
+
+    # the server records the timings each worker reports
+    instrumentation.enable()
+    service = InferenceService(model_path, workers, threads, prefork)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Inference service on http://{host}:{port} "
+          f"({workers} {'forked ' if prefork else ''}workers x {service.threads} threads, "
+          f"model {service.model_version})")
+    print_memory(service.memory())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+# =======================================
+# CLIENT (used by pages/Reports.py)
+# =======================================
+
+class ServiceUnavailable(RuntimeError):
+    pass
+
+
+class RemoteReport:
+    """
+    Same surface as report_utils.DeferredReport for a PDF held by the
+    service: fetched on the first get() (or download click) and kept.
+    """
+
+    def __init__(self, client, report_id):
+        self.client = client
+        self.report_id = report_id
+        self._pdf = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        return self
+
+    def ready(self):
+        return self._pdf is not None
+
+    def get(self, timeout=None):
+        with self._lock:
+            if self._pdf is None:
+                self._pdf = self.client._request(f"/report/{self.report_id}", timeout=timeout)
+                callbacks, self._callbacks = self._callbacks, []
+            else:
+                callbacks = []
+        for fn in callbacks:
+            fn(self._pdf)
+        return self._pdf
+
+    __call__ = get
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if self._pdf is None:
+                self._callbacks.append(fn)
+                return
+        fn(self._pdf)
+
+
+class InferenceClient:
+    def __init__(self, base_url, timeout=REQUEST_TIMEOUT_S):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._health = None
+
+    def _request(self, path, data=None, timeout=None):
+        req = urllib.request.Request(self.base_url + path, data=data)
+        if data is not None:
+            req.add_header("Content-Type", "application/octet-stream")
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as resp:
+                return resp.read()
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", "replace")
+            if e.code == 400:
+                raise ValueError(json.loads(detail).get("error", detail)) from None
+            raise ServiceUnavailable(f"{path}: HTTP {e.code} {detail}") from None
+        except OSError as e:
+            raise ServiceUnavailable(f"{self.base_url} unreachable: {e}") from None
+
+    def health(self):
+        return json.loads(self._request("/health", timeout=5))
+
+    def model_version(self):
+        if self._health is None:
+            self._health = self.health()
+        return self._health["model_version"]
+
+    def analyze(self, image_bytes):
+        """(cls, prob, RemoteReport, timings), like run_pipeline(..., defer_pdf=True, return_timings=True)."""
+        reply = json.loads(self._request("/analyze", data=image_bytes))
+        return reply["cls"], reply["prob"], RemoteReport(self, reply["report_id"]), reply["timings"]
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_inference_client(base_url=INFERENCE_URL):
+    """Process-wide client per service URL, shared by every session."""
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(base_url)
+        if client is None:
+            client = _CLIENTS[base_url] = InferenceClient(base_url)
+        return client
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="DR inference service")
+    parser.add_argument("--model", default="efficientnet_b3_state_dict.pt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--prefork", action="store_true",
+                        help="load the model once and fork workers that share its weights")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.model):
+        parser.error(f"model checkpoint not found: {args.model}")
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+    if args.prefork and not hasattr(os, "fork"):
+        parser.error("--prefork needs fork(); not available on this platform")
+    # library modules log model loads and storage failures
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    serve(args.model, args.host, args.port, args.workers, args.threads, args.prefork)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,251 @@
+# ============================
+# PER-STAGE TIMING + MEMORY INSTRUMENTATION
+# ============================
+# with span("decode"): ...   records wall time, thread CPU time, growth of
+# the process peak RSS and (when tracemalloc is tracing) the traced peak
+# allocated inside the block, aggregated per span name into histograms.
+#
+# Disabled by default: span() then returns one shared no-op context manager,
+# so instrumented code pays a function call and nothing else.
+#
+#   DR_INSTRUMENTATION=1       enable at import
+#   DR_TRACEMALLOC=1           also start tracemalloc (slows allocation-heavy code)
+#   DR_METRICS_FILE=path.prom  rewrite a Prometheus textfile every
+#                              DR_METRICS_INTERVAL seconds (default 15)
+#
+# snapshot() / to_json() / to_prometheus() export what has been recorded.
+# tracemalloc peaks are process-wide, so overlapping spans in different
+# threads see each other's allocations.
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from atomic_files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_stats = {}
+_exporter = None
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _StageStats:
+    __slots__ = ("count", "wall_sum", "cpu_sum", "wall_max", "buckets",
+                 "rss_growth_max", "traced_peak_max")
+
+    def __init__(self):
+        self.count = 0
+        self.wall_sum = 0.0
+        self.cpu_sum = 0.0
+        self.wall_max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.rss_growth_max = 0
+        self.traced_peak_max = 0
+
+    def add(self, wall, cpu, rss_growth, traced_peak):
+        self.count += 1
+        self.wall_sum += wall
+        self.cpu_sum += cpu
+        self.wall_max = max(self.wall_max, wall)
+        for i, bound in enumerate(BUCKETS):
+            if wall <= bound:
+                self.buckets[i] += 1
+        self.rss_growth_max = max(self.rss_growth_max, rss_growth)
+        self.traced_peak_max = max(self.traced_peak_max, traced_peak)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "wall_seconds_sum": self.wall_sum,
+            "wall_seconds_mean": self.wall_sum / self.count if self.count else 0.0,
+            "wall_seconds_max": self.wall_max,
+            "cpu_seconds_sum": self.cpu_sum,
+            "buckets": dict(zip([str(b) for b in BUCKETS], self.buckets)),
+            "rss_growth_bytes_max": self.rss_growth_max,
+            "tracemalloc_peak_bytes_max": self.traced_peak_max,
+        }
+
+
+class _Span:
+    __slots__ = ("name", "wall", "cpu", "rss", "traced")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.traced = tracemalloc.is_tracing()
+        if self.traced:
+            tracemalloc.reset_peak()
+            self.traced = tracemalloc.get_traced_memory()[0]
+        self.rss = peak_rss_bytes()
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        rss_growth = peak_rss_bytes() - self.rss
+        traced_peak = 0
+        if self.traced is not False:
+            traced_peak = max(0, tracemalloc.get_traced_memory()[1] - self.traced)
+        record(self.name, wall, cpu, rss_growth, traced_peak)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name):
+    """Context manager timing one block under name; a no-op while disabled."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name)
+
+
+def record(name, wall, cpu=0.0, rss_growth=0, traced_peak=0):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = _StageStats()
+        stats.add(wall, cpu, rss_growth, traced_peak)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(trace_malloc=False, metrics_file=None, interval=15.0):
+    global _enabled
+    _enabled = True
+    if trace_malloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if metrics_file:
+        start_textfile_exporter(metrics_file, interval)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+# =======================================
+# EXPORT
+# =======================================
+
+def snapshot():
+    with _lock:
+        stages = {name: stats.as_dict() for name, stats in _stats.items()}
+    return {
+        "timestamp": time.time(),
+        "enabled": _enabled,
+        "process_peak_rss_bytes": peak_rss_bytes(),
+        "stages": stages,
+    }
+
+
+def to_json(indent=None):
+    return json.dumps(snapshot(), indent=indent)
+
+
+def to_prometheus(prefix="dr_stage"):
+    snap = snapshot()
+    lines = [
+        f"# HELP {prefix}_seconds Wall time per pipeline stage.",
+        f"# TYPE {prefix}_seconds histogram",
+    ]
+    for name, s in sorted(snap["stages"].items()):
+        label = f'stage="{name}"'
+        for bound, count in s["buckets"].items():
+            lines.append(f'{prefix}_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'{prefix}_seconds_bucket{{{label},le="+Inf"}} {s["count"]}')
+        lines.append(f'{prefix}_seconds_sum{{{label}}} {s["wall_seconds_sum"]:.6f}')
+        lines.append(f'{prefix}_seconds_count{{{label}}} {s["count"]}')
+
+    metrics = (
+        ("cpu_seconds_total", "counter", "Thread CPU time per pipeline stage.", "cpu_seconds_sum"),
+        ("rss_growth_bytes_max", "gauge", "Largest process peak-RSS growth inside one stage.", "rss_growth_bytes_max"),
+        ("tracemalloc_peak_bytes_max", "gauge", "Largest traced allocation peak inside one stage.", "tracemalloc_peak_bytes_max"),
+    )
+    for metric, kind, help_text, key in metrics:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {kind}")
+        for name, s in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_{metric}{{stage="{name}"}} {s[key]}')
+
+    lines.append("# HELP process_peak_rss_bytes Peak resident set size of the process.")
+    lines.append("# TYPE process_peak_rss_bytes gauge")
+    lines.append(f"process_peak_rss_bytes {snap['process_peak_rss_bytes']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Atomically (re)write a node_exporter textfile-collector file."""
+    atomic_write(path, to_prometheus())
+
+
+def write_json(path):
+    atomic_write(path, to_json(indent=2))
+
+
+def start_textfile_exporter(path, interval=15.0):
+    """Daemon thread rewriting path every interval seconds; started once per process."""
+    global _exporter
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_prometheus(path)
+            except OSError as e:
+                logger.warning("Metrics export to %s failed: %s", path, e)
+
+    with _lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=loop, name="metrics-exporter", daemon=True)
+            _exporter.start()
+    return _exporter
+
+
+if os.environ.get("DR_INSTRUMENTATION") == "1":
+    enable(
+        trace_malloc=os.environ.get("DR_TRACEMALLOC") == "1",
+        metrics_file=os.environ.get("DR_METRICS_FILE"),
+        interval=float(os.environ.get("DR_METRICS_INTERVAL", "15")),
+    )
@@ -0,0 +1,349 @@
+# ============================
+# LOAD TEST — CONCURRENT STREAMLIT SESSIONS
+# ============================
+# Drives the real app.py -> Login -> Reports flow through Streamlit's AppTest,
+# one AppTest per simulated clinician, all in this process (as they would
+# share one server process), with auth.py's Supabase client replaced by a
+# local stub. For each concurrency level it records upload-to-result
+# latency, throughput, CPU utilisation and RSS, and prints the saturation
+# curve.
+#
+# Usage:
+#   python loadtest.py [--sessions 1 2 4 8 16] [--uploads 5] [--model ckpt.pt]
+#                      [--resolution 2048x1536] [--repeat-images] [--output curve.json]
+#
+# Without --model a randomly initialised EfficientNet-B3 is used (see
+# benchmark.random_checkpoint). Each upload is a distinct image unless
+# --repeat-images, so the result cache only helps when asked to.
+#
+# AppTest swaps process globals (the Runtime singleton, st.secrets) for the
+# length of a script run, so script runs are serialised here. Analyses run
+# as background jobs (analysis_jobs.py) and still overlap freely; what is
+# serialised is the short page renders and result polls.
+
+import os
+import sys
+import json
+import time
+import types
+import logging
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import cv2
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+from benchmark import synthetic_fundus, random_checkpoint, _percentile
+from instrumentation import peak_rss_bytes
+
+# the filename pages/Reports.py downloads to / loads from
+MODEL_FILENAME = "efficientnet_b3_state_dict.pt"
+DEFAULT_SESSIONS = [1, 2, 4, 8, 16]
+RUN_TIMEOUT_S = 300
+
+_APPTEST_LOCK = threading.Lock()
+POLL_INTERVAL_S = 0.02
+
+
+# =======================================
+# SUPABASE STUB
+# =======================================
+
+class _StubAuth:
+    def sign_up(self, credentials):
+        return SimpleNamespace(user=SimpleNamespace(email=credentials["email"]), session=None)
+
+    def sign_in_with_password(self, credentials):
+        return SimpleNamespace(user=SimpleNamespace(email=credentials["email"]),
+                               session=SimpleNamespace(access_token="stub"))
+
+    def sign_out(self):
+        return None
+
+
+class StubSupabase:
+    """Accepts every sign-up and login, without network access."""
+
+    def __init__(self, url=None, key=None):
+        self.auth = _StubAuth()
+
+
+def install_auth_stub():
+    """Make auth.py build a StubSupabase instead of a real client."""
+    supabase = types.ModuleType("supabase")
+    supabase.create_client = StubSupabase
+    sys.modules["supabase"] = supabase
+
+    try:
+        import supabase_auth.errors  # noqa: F401
+    except ImportError:
+        errors = types.ModuleType("supabase_auth.errors")
+        errors.AuthApiError = type("AuthApiError", (Exception,), {})
+        package = types.ModuleType("supabase_auth")
+        package.errors = errors
+        sys.modules["supabase_auth"] = package
+        sys.modules["supabase_auth.errors"] = errors
+
+    # re-import auth against the stub
+    sys.modules.pop("auth", None)
+
+
+# =======================================
+# RESOURCE SAMPLING
+# =======================================
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_bytes()
+
+
+class ResourceSampler:
+    """Samples process RSS in the background; CPU from process_time deltas."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = time.process_time() - self._cpu
+        return False
+
+    def summary(self):
+        samples = self.samples or [current_rss_bytes()]
+        return {
+            "cpu_seconds": self.cpu_seconds,
+            # 1.0 == every core busy for the whole level
+            "cpu_utilisation": self.cpu_seconds / self.wall_seconds / (os.cpu_count() or 1),
+            "rss_mean_MiB": sum(samples) / len(samples) / 2**20,
+            "rss_max_MiB": max(samples) / 2**20,
+        }
+
+
+# =======================================
+# SIMULATED SESSION
+# =======================================
+
+class Session:
+    """One logged-in clinician on the Reports page."""
+
+    def __init__(self, index, timeout=RUN_TIMEOUT_S):
+        from streamlit.testing.v1 import AppTest
+
+        self.email = f"loadtest-{index}@example.com"
+        self.at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=timeout)
+        self.at.secrets["SUPABASE_URL"] = "http://supabase.stub"
+        self.at.secrets["SUPABASE_KEY"] = "stub"
+
+    def _run(self):
+        with _APPTEST_LOCK:
+            self.at.run()
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def login(self):
+        self._run()  # auth gate
+        self.at.switch_page("pages/Login.py")
+        self._run()
+        self.at.text_input[0].input(self.email)
+        self.at.text_input[1].input("loadtest-password")
+        self.at.button[0].click()
+        self._run()
+        if not self.at.session_state.authenticated:
+            raise RuntimeError(f"login failed for {self.email}")
+        self.at.switch_page("pages/Reports.py")
+        self._run()
+
+    def _has_result(self):
+        return any("Confidence" in m.value for m in self.at.markdown)
+
+    def upload(self, name, data, poll_interval=POLL_INTERVAL_S, timeout=RUN_TIMEOUT_S):
+        """Seconds from upload to the rendered result card."""
+        self.at.file_uploader[0].set_value((name, data, "image/jpeg"))
+        t0 = time.perf_counter()
+        self._run()
+        # the analysis runs as a background job; rerun as the result fragment's polling would
+        while not self._has_result():
+            if self.at.error:
+                raise RuntimeError(self.at.error[0].value)
+            if time.perf_counter() - t0 > timeout:
+                raise RuntimeError("no result rendered")
+            time.sleep(poll_interval)
+            self._run()
+        return time.perf_counter() - t0
+
+
+def make_uploads(count, width, height, seed=0):
+    uploads = []
+    for i in range(count):
+        _, enc = cv2.imencode(".jpg", synthetic_fundus(width, height, seed=seed + i),
+                              [cv2.IMWRITE_JPEG_QUALITY, 92])
+        uploads.append((f"fundus_{seed + i}.jpg", enc.tobytes()))
+    return uploads
+
+
+def run_level(n_sessions, uploads_per_session, width, height, repeat_images=False, seed=0):
+    """Log in n_sessions, then have them all upload at once; one point of the curve."""
+    from inference_scheduler import get_scheduler
+    from analysis_jobs import get_job_manager
+
+    sessions = [Session(i) for i in range(n_sessions)]
+    for s in sessions:
+        s.login()
+
+    if repeat_images:
+        shared = make_uploads(uploads_per_session, width, height, seed)
+        work = [shared for _ in sessions]
+    else:
+        work = [make_uploads(uploads_per_session, width, height, seed + i * uploads_per_session)
+                for i in range(n_sessions)]
+
+    scheduler = get_scheduler(MODEL_FILENAME)
+    before = scheduler.stats()
+    admission = get_job_manager().admission
+    admission.reset_stats()
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(n_sessions)
+
+    def drive(session, uploads):
+        start.wait()
+        for name, data in uploads:
+            try:
+                elapsed = session.upload(name, data)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=drive, args=(s, w), name=f"session-{i}")
+               for i, (s, w) in enumerate(zip(sessions, work))]
+    with ResourceSampler() as sampler:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    after = scheduler.stats()
+    queue = admission.stats()
+
+    latencies.sort()
+    batches = after["batches"] - before["batches"]
+    result = {
+        "sessions": n_sessions,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": sampler.wall_seconds,
+        "throughput_per_s": len(latencies) / sampler.wall_seconds,
+        "latency_ms_p50": _percentile(latencies, 0.50) * 1000.0 if latencies else 0.0,
+        "latency_ms_p95": _percentile(latencies, 0.95) * 1000.0 if latencies else 0.0,
+        "latency_ms_p99": _percentile(latencies, 0.99) * 1000.0 if latencies else 0.0,
+        "latency_ms_max": latencies[-1] * 1000.0 if latencies else 0.0,
+        "mean_batch_size": (after["requests"] - before["requests"]) / batches if batches else 0.0,
+        "queue_wait_ms_p50": queue["wait_ms_p50"],
+        "queue_wait_ms_p95": queue["wait_ms_p95"],
+        "shed": queue["shed"],
+        "error_samples": errors[:5],
+    }
+    result.update(sampler.summary())
+    return result
+
+
+def saturation_point(curve, fraction=0.9):
+    """Fewest sessions reaching fraction of the best throughput: past it, latency just grows."""
+    best = max(point["throughput_per_s"] for point in curve)
+    for point in curve:
+        if point["throughput_per_s"] >= fraction * best:
+            return point["sessions"]
+    return None
+
+
+def print_curve(curve):
+    print(f"{'sessions':>8} {'req':>5} {'err':>4} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'batch':>6} {'q p95':>7} {'shed':>5} {'cpu':>5} {'rss MiB':>8}")
+    for p in curve:
+        print(f"{p['sessions']:>8} {p['requests']:>5} {p['errors']:>4} {p['throughput_per_s']:7.2f} "
+              f"{p['latency_ms_p50']:9.0f} {p['latency_ms_p95']:9.0f} {p['latency_ms_p99']:9.0f} "
+              f"{p['mean_batch_size']:6.1f} {p['queue_wait_ms_p95']:7.0f} {p['shed']:>5} "
+              f"{p['cpu_utilisation']:5.0%} {p['rss_max_MiB']:8.0f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the Streamlit app")
+    parser.add_argument("--sessions", type=int, nargs="+", default=DEFAULT_SESSIONS)
+    parser.add_argument("--uploads", type=int, default=5, help="uploads per session per level")
+    parser.add_argument("--model", help="checkpoint to serve (default: random EfficientNet-B3)")
+    parser.add_argument("--resolution", default="2048x1536")
+    parser.add_argument("--repeat-images", action="store_true",
+                        help="every session uploads the same images (exercises the result cache)")
+    parser.add_argument("--workdir", help="directory the app runs in (default: a temp dir)")
+    parser.add_argument("--output", help="write the curve as JSON")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    model = os.path.abspath(args.model) if args.model else random_checkpoint()
+
+    # Reports.py loads MODEL_FILENAME from the working directory
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dr_loadtest_")
+    os.makedirs(workdir, exist_ok=True)
+    target = os.path.join(workdir, MODEL_FILENAME)
+    if not os.path.exists(target):
+        os.symlink(model, target)
+    os.chdir(workdir)
+
+    # library modules log model loads and storage failures
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # the pages' empty widget labels log a warning with a stack on every run
+    logging.getLogger("streamlit.elements.lib.policies").disabled = True
+    install_auth_stub()
+
+    # model load, imports and PDF templates are not part of any level
+    warm = Session("warmup")
+    warm.login()
+    warm.upload(*make_uploads(1, width, height, seed=10**9)[0])
+
+    curve = []
+    for i, n in enumerate(args.sessions):
+        point = run_level(n, args.uploads, width, height, args.repeat_images, seed=i * 100000)
+        curve.append(point)
+        print(f"{n} sessions: {point['throughput_per_s']:.2f} req/s, "
+              f"p95 {point['latency_ms_p95']:.0f} ms, {point['errors']} errors", flush=True)
+
+    print()
+    print_curve(curve)
+    knee = saturation_point(curve)
+    print(f"\nthroughput saturates at ~{knee} concurrent sessions")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"resolution": args.resolution, "uploads_per_session": args.uploads,
+                       "cpu_count": os.cpu_count(), "saturation_sessions": knee,
+                       "curve": curve}, f, indent=2)
+    return 1 if any(p["errors"] for p in curve) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+# ============================
+# VERIFIED, RESUMABLE MODEL DOWNLOAD
+# ============================
+# download_model(url, dest) streams the checkpoint in chunks to dest.part,
+# resuming a previous partial download with an HTTP Range request, checks
+# its SHA-256 and only then renames it onto dest. dest therefore either
+# does not exist or is a complete, verified file; a truncated download can
+# no longer break load_model.
+#
+# The expected digest is the sha256 argument (DR_MODEL_SHA256 for the app)
+# or, failing that, the one the server advertises: Hugging Face reports
+# LFS files' SHA-256 in X-Linked-Etag / ETag. With neither, the file is
+# still downloaded atomically and its digest returned.
+#
+#   python model_download.py URL DEST [--sha256 HEX]
+
+import os
+import re
+import sys
+import hashlib
+import argparse
+
+CHUNK_SIZE = 1 << 20
+TIMEOUT_S = 30
+_SHA256_RE = re.compile(r'^(?:W/)?"?([0-9a-f]{64})"?$')
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+def _advertised_sha256(response):
+    """SHA-256 from X-Linked-Etag / ETag on the response or a redirect before it."""
+    for r in list(response.history) + [response]:
+        for header in ("X-Linked-Etag", "ETag"):
+            match = _SHA256_RE.match(r.headers.get(header, "").strip().lower())
+            if match:
+                return match.group(1)
+    return None
+
+
+def _hash_file(path, h):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+
+
+def download_model(url, dest, sha256=None, chunk_size=CHUNK_SIZE, timeout=TIMEOUT_S,
+                   progress=None, session=None):
+    """
+    Download url to dest atomically, resuming dest + ".part" if present.
+    progress(bytes_done, bytes_total_or_None) is called per chunk. Returns
+    the file's SHA-256; raises ChecksumMismatch (and drops the partial file)
+    when it does not match sha256 or the server's advertised digest.
+    """
+    import requests
+
+    part = dest + ".part"
+    http = session or requests
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with http.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 416:
+            # nothing left to fetch: the partial file is already complete
+            mode, total = "ab", offset
+        else:
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                offset = 0  # server ignored the Range header: start over
+            mode = "ab" if offset else "wb"
+            length = r.headers.get("Content-Length")
+            total = offset + int(length) if length is not None else None
+
+        expected = (sha256 or _advertised_sha256(r) or "").lower() or None
+        h = hashlib.sha256()
+        if offset:
+            _hash_file(part, h)
+
+        done = offset
+        with open(part, mode) as f:
+            if r.status_code != 416:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    h.update(chunk)
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(done, total)
+            f.flush()
+            os.fsync(f.fileno())
+
+    if total is not None and done != total:
+        # connection dropped: keep the part file so the next call resumes
+        raise IOError(f"download incomplete: {done} of {total} bytes")
+
+    digest = h.hexdigest()
+    if expected and digest != expected:
+        os.remove(part)
+        raise ChecksumMismatch(f"{url}: sha256 {digest} != expected {expected}")
+
+    os.replace(part, dest)
+    return digest
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Download a model checkpoint with verification")
+    parser.add_argument("url")
+    parser.add_argument("dest")
+    parser.add_argument("--sha256", default=None)
+    args = parser.parse_args(argv)
+
+    def show(done, total):
+        pct = f" ({done / total:.0%})" if total else ""
+        print(f"\r{done / 2**20:.1f} MiB{pct}", end="", flush=True)
+
+    digest = download_model(args.url, args.dest, args.sha256, progress=show)
+    print(f"\n{args.dest}: sha256 {digest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,314 @@
+# ============================
+# NEAR-DUPLICATE UPLOADS (PERCEPTUAL HASH)
+# ============================
+# The result cache keys on the upload's bytes, so the same fundus photo
+# re-exported or recompressed misses it and runs the whole pipeline again.
+# Here each analysed image gets a 64-bit DCT perceptual hash of its
+# preprocess_fundus output (cropped, resized, CLAHE'd: camera border and
+# resolution are already normalised away). A new upload whose hash lies
+# within NEAR_DUPLICATE_DISTANCE bits of one of the same user's earlier
+# uploads is a candidate; it only reuses that upload's classification once
+# confirm() has compared it pixel by pixel with the stored original. The
+# report is still rendered from the new upload's own images, and the
+# Reports page says so and offers a fresh analysis instead.
+#
+# The hash alone does not separate fundus images reliably: on 200
+# benchmark.synthetic_fundus seeds (19,900 pairs) distinct images come as
+# close as 2 bits at 2048x1536 (4 at 800x600), while re-encodes of one
+# image (JPEG q35-92, PNG, half size, +8% brightness, 2% crop) drift up to
+# 8 (10). At distance 4, 85-89% of those re-encodes are candidates, and 8
+# (4) distinct pairs are; confirm() rejects all of them: distinct images
+# correlate at most 0.674 (0.620), re-encodes at least 0.906 (0.759).
+#
+# Candidates come from multi-index hashing: the 64 bits are split into
+# CHUNKS 16-bit chunks, each with its own table. Two hashes within
+# distance r agree to within r // CHUNKS bits on at least one chunk
+# (pigeonhole), so a search probes, per table, only the buckets of the
+# query's chunk and its neighbours within that radius, then checks the
+# exact distance of what it finds. See "python benchmark.py
+# near-duplicates" for lookup throughput against 1M stored hashes.
+#
+# Hashes live in the upload history (history_store.py), so an index only
+# ever holds one user's uploads; it is built from there on the user's
+# first lookup (or ahead of it by warm()), outside any shared lock.
+
+import os
+import threading
+from itertools import combinations
+
+import report_utils as ru
+from instrumentation import span
+from artifact_store import get_artifact_store
+from history_store import get_history_store
+
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("DR_NEAR_DUPLICATE_DISTANCE", "4"))
+# confirm(): correlation of vessel-scale detail needed to reuse a result
+MIN_CORRELATION = float(os.environ.get("DR_NEAR_DUPLICATE_CORRELATION", "0.72"))
+HASH_BITS = 64
+CHUNKS = 4
+_CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+# pHash over a mid-frequency band: DCT of a 64x64 grey image, sign of the
+# 8x8 coefficients from frequency 6 up vs their median. Classic pHash uses
+# the lowest 8x8, but CLAHE in preprocess_fundus flattens low frequencies
+# (an 8x8 average hash of its output is constant), so re-encodes of one
+# image flipped up to 14 of those bits; the vessel-scale band keeps them
+# within the distances given above.
+_DCT_SIZE = 64
+_BAND = slice(6, 14)
+# confirm(): grey fundus at 256x256, band-passed between Gaussian sigmas 1
+# and 3 px (vessels; removes JPEG noise and the shared disc/background)
+_DETAIL_SIZE = 256
+_DETAIL_SIGMAS = (1.0, 3.0)
+
+
+def perceptual_hash(fundus):
+    """64-bit perceptual hash of a preprocess_fundus output (RGB or grey uint8)."""
+    cv2, np = ru.cv2, ru.np
+    gray = cv2.cvtColor(fundus, cv2.COLOR_RGB2GRAY) if fundus.ndim == 3 else fundus
+    small = cv2.resize(gray, (_DCT_SIZE, _DCT_SIZE), interpolation=cv2.INTER_AREA)
+    band = cv2.dct(small.astype(np.float32))[_BAND, _BAND].flatten()
+    bits = band > np.median(band)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _detail(fundus):
+    cv2, np = ru.cv2, ru.np
+    gray = cv2.cvtColor(fundus, cv2.COLOR_RGB2GRAY) if fundus.ndim == 3 else fundus
+    small = cv2.resize(gray, (_DETAIL_SIZE, _DETAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    fine, coarse = (cv2.GaussianBlur(small, (0, 0), sigma) for sigma in _DETAIL_SIGMAS)
+    detail = fine - coarse
+    detail -= detail.mean()
+    norm = float(np.linalg.norm(detail))
+    return detail / norm if norm else detail
+
+
+def confirm(fundus, original_jpeg):
+    """
+    Correlation (-1..1) of a preprocess_fundus output with the stored
+    original report image of an earlier upload, preprocessed the same way.
+    """
+    stored = ru.preprocess_engine.fundus(ru.decode_image(original_jpeg))
+    return float((_detail(fundus) * _detail(stored)).sum())
+
+
+def _popcount(x):
+    """Per-element set bits of a uint64 array."""
+    np = ru.np
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x)
+    table = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+    return table[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _flips(bits, radius):
+    """Every mask of at most radius set bits within a bits-wide chunk."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(bits), r):
+            mask = 0
+            for p in positions:
+                mask |= 1 << p
+            masks.append(mask)
+    return masks
+
+
+class MultiIndexHash:
+    """
+    Hamming-radius search over 64-bit hashes, each with a value.
+
+    Hashes are held in one uint64 array; for each chunk table, the
+    positions of all hashes sorted by that chunk plus the offset of every
+    chunk value (CSR), so a search gathers its probed buckets and checks
+    them in a few vectorised steps. Hashes added since the last rebuild
+    wait in a short list that is scanned linearly (also vectorised); the
+    arrays are rebuilt once it outgrows REBUILD_FRACTION of the index.
+    """
+
+    REBUILD_MIN = 1024
+    REBUILD_FRACTION = 1 / 16
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        np = ru.np
+        self.max_distance = max_distance
+        masks = np.array(_flips(_CHUNK_BITS, max_distance // CHUNKS), np.int64)
+        # bucket ids probed per table, before adding the query's chunk
+        self._probe_xor = np.tile(masks, CHUNKS)
+        self._probe_base = np.repeat(np.arange(CHUNKS, dtype=np.int64) << _CHUNK_BITS, len(masks))
+        self._shifts = np.repeat(np.arange(CHUNKS, dtype=np.uint64) * np.uint64(_CHUNK_BITS), len(masks))
+        self._hashes = np.zeros(0, np.uint64)
+        self._positions = np.zeros(0, np.int64)
+        self._offsets = np.zeros((CHUNKS << _CHUNK_BITS) + 1, np.int64)
+        self._pending = []
+        self._pending_array = None
+        self._values = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, h, value):
+        with self._lock:
+            self._pending.append(h)
+            self._pending_array = None
+            self._values.append(value)
+            if len(self._pending) > max(self.REBUILD_MIN, len(self._hashes) * self.REBUILD_FRACTION):
+                self._rebuild()
+
+    def add_many(self, hashes, values):
+        with self._lock:
+            self._pending.extend(int(h) for h in hashes)
+            self._values.extend(values)
+            self._rebuild()
+
+    def search(self, h, max_distance=None):
+        """[(distance, value)] within max_distance of h, nearest first."""
+        np = ru.np
+        r = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            hits = []
+            if len(self._hashes):
+                query = np.uint64(h)
+                chunks = ((query >> self._shifts) & np.uint64(_CHUNK_MASK)).astype(np.int64)
+                buckets = self._probe_base + (chunks ^ self._probe_xor)
+                starts = self._offsets[buckets]
+                lengths = self._offsets[buckets + 1] - starts
+                total = int(lengths.sum())
+                if total:
+                    # concatenated ranges [start, start + length) of every probed bucket
+                    ends = np.cumsum(lengths)
+                    idx = np.arange(total) + np.repeat(starts - (ends - lengths), lengths)
+                    positions = self._positions[idx]
+                    distances = _popcount(self._hashes[positions] ^ query)
+                    near = distances <= r
+                    # a hash close on several chunks shows up once per table
+                    positions, first = np.unique(positions[near], return_index=True)
+                    hits = [(int(d), self._values[p])
+                            for p, d in zip(positions.tolist(), distances[near][first].tolist())]
+
+            if self._pending:
+                if self._pending_array is None:
+                    self._pending_array = np.array(self._pending, np.uint64)
+                distances = _popcount(self._pending_array ^ np.uint64(h))
+                base = len(self._hashes)
+                for i in np.flatnonzero(distances <= r).tolist():
+                    hits.append((int(distances[i]), self._values[base + i]))
+        hits.sort(key=lambda hit: hit[0])
+        return hits
+
+    def _rebuild(self):
+        np = ru.np
+        if not self._pending:
+            return
+        hashes = np.concatenate([self._hashes, np.array(self._pending, np.uint64)])
+        n = len(hashes)
+        keys = np.empty(CHUNKS * n, np.int64)
+        for i in range(CHUNKS):
+            chunk = (hashes >> np.uint64(i * _CHUNK_BITS)) & np.uint64(_CHUNK_MASK)
+            keys[i * n:(i + 1) * n] = chunk.astype(np.int64) + (i << _CHUNK_BITS)
+        order = np.argsort(keys, kind="stable")
+        counts = np.bincount(keys, minlength=CHUNKS << _CHUNK_BITS)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._positions = order % n
+        self._hashes = hashes
+        self._pending = []
+        self._pending_array = None
+
+
+class NearDuplicateIndex:
+    """Per-user pHash -> result_key indexes; lookups confirm candidates against stored images."""
+
+    def __init__(self, artifacts, history, max_distance=NEAR_DUPLICATE_DISTANCE,
+                 min_correlation=MIN_CORRELATION):
+        self.artifacts = artifacts
+        self.history = history
+        self.max_distance = max_distance
+        self.min_correlation = min_correlation
+        self._indexes = {}
+        self._warming = set()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "candidates": 0, "hits": 0, "rejected": 0, "stale": 0}
+
+    def _index(self, user):
+        with self._lock:
+            index = self._indexes.get(user)
+        if index is not None:
+            return index
+        # one indexed query for this user's rows, with no lock held; if two
+        # threads race, both build and the first to finish is kept
+        stored = self.history.phashes(user)
+        index = MultiIndexHash(self.max_distance)
+        index.add_many([h for h, _ in stored], [key for _, key in stored])
+        with self._lock:
+            self._warming.discard(user)
+            return self._indexes.setdefault(user, index)
+
+    def warm(self, user):
+        """Build user's index in the background, ahead of their first lookup."""
+        with self._lock:
+            if user in self._indexes or user in self._warming:
+                return
+            self._warming.add(user)
+        threading.Thread(target=self._index, args=(user,), name="near-duplicates-warm", daemon=True).start()
+
+    def add(self, user, phash, result_key):
+        self._index(user).add(phash, result_key)
+
+    def find(self, user, phash, model_version, fundus):
+        """
+        (result_key, manifest, distance) of user's nearest earlier upload that
+        confirm() accepts for fundus and that model_version produced, or None.
+        """
+        found, counts = None, {"candidates": 0, "rejected": 0, "stale": 0}
+        with span("near_duplicate_lookup"):
+            seen = set()
+            for distance, key in self._index(user).search(phash):
+                if key in seen:
+                    continue
+                seen.add(key)
+                manifest = self.artifacts.get(key)
+                if manifest is None:
+                    counts["stale"] += 1  # collected by artifact GC
+                    continue
+                if manifest.get("model_version") != model_version:
+                    continue
+                images = self.artifacts.report_images(key)
+                if images is None:
+                    counts["stale"] += 1
+                    continue
+                counts["candidates"] += 1
+                if confirm(fundus, images[0]) < self.min_correlation:
+                    counts["rejected"] += 1
+                    continue
+                found = key, manifest, distance
+                break
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["hits"] += found is not None
+            for name, n in counts.items():
+                self._stats[name] += n
+        return found
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._indexes)
+            stats["hashes"] = sum(len(index) for index in self._indexes.values())
+        return stats
+
+
+_NEAR_DUPLICATES = None
+_NEAR_DUPLICATES_LOCK = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """Process-wide index over the shared artifact and history stores."""
+    global _NEAR_DUPLICATES
+    with _NEAR_DUPLICATES_LOCK:
+        if _NEAR_DUPLICATES is None:
+            _NEAR_DUPLICATES = NearDuplicateIndex(get_artifact_store(), get_history_store())
+        return _NEAR_DUPLICATES
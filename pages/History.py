@@ -1,4 +1,11 @@
 import streamlit as st
+import html
+import time
+import base64
+from datetime import datetime, timedelta
+from history_store import get_history_store, PAGE_SIZE
+from artifact_store import get_artifact_store
+from report_utils import CLASS_NAMES
 
 # ================= PAGE CONFIG =================
 st.set_page_config(
@@ -154,6 +161,19 @@ html, body {
 .item:last-child {
     border-bottom:none;
 }
+.item-row {
+    display:flex;
+    align-items:center;
+    gap:18px;
+}
+.thumb {
+    width:72px;
+    height:72px;
+    flex:none;
+    border-radius:12px;
+    object-fit:cover;
+    background:rgba(255,255,255,.06);
+}
 
 .filename {
     font-weight:600;
@@ -163,6 +183,10 @@ html, body {
     font-size:13px;
     color:#9aa6c7;
 }
+.stage {
+    font-size:14px;
+    color:#7cf5d3;
+}
 </style>
 """, unsafe_allow_html=True)
 
@@ -174,19 +198,104 @@ st.markdown(f"""
 </p>
 """, unsafe_allow_html=True)
 
-# ================= HISTORY (NO CARD) =================
-uploads = st.session_state.get("upload_history", [])
+# ================= FILTERS =================
+store = get_history_store()
+user_email = st.session_state.get("user_email", "")
+
+col_dates, col_stages = st.columns(2)
+with col_dates:
+    dates = st.date_input("Date range", value=(), format="YYYY-MM-DD")
+with col_stages:
+    stages = st.multiselect("Stage", CLASS_NAMES)
+
+since = until = None
+if len(dates) >= 1:
+    since = time.mktime(dates[0].timetuple())
+    # inclusive end date: everything before the following midnight
+    until = time.mktime((dates[-1] + timedelta(days=1)).timetuple())
+
+# ================= PAGINATION =================
+# keyset cursors of the pages visited so far; reset when the filters change
+filters = (since, until, tuple(stages))
+if st.session_state.get("history_filters") != filters:
+    st.session_state.history_filters = filters
+    st.session_state.history_cursors = [None]
+
+cursors = st.session_state.history_cursors
+uploads, next_cursor = store.page(user_email, cursors[-1], PAGE_SIZE, since, until, stages)
 
+# ================= HISTORY (NO CARD) =================
 if not uploads:
+    message = "No uploads match these filters." if since is not None or stages else "No uploads yet."
     st.markdown(
-        '<p style="text-align:center;color:#9aa6c7;margin-top:40px;">No uploads yet.</p>',
+        f'<p style="text-align:center;color:#9aa6c7;margin-top:40px;">{message}</p>',
         unsafe_allow_html=True
     )
 else:
-    for item in uploads:
-        st.markdown(f"""
-        <div class="item">
-            <div class="filename">{item["filename"]}</div>
-            <div class="timestamp">{item["timestamp"]}</div>
-        </div>
-        """, unsafe_allow_html=True)
+    # thumbnails for this page only, inlined so the page stays one element
+    artifacts = get_artifact_store()
+    thumbs = artifacts.thumbnails([item["result_key"] for item in uploads])
+
+    def thumb_html(item):
+        found = thumbs.get(item["result_key"])
+        if found is None:
+            return '<div class="thumb"></div>'
+        data, mime = found
+        return (f'<img class="thumb" loading="lazy" alt="" '
+                f'src="data:{mime};base64,{base64.b64encode(data).decode()}">')
+
+    items = "".join(f"""
+        <div class="item"><div class="item-row">
+            {thumb_html(item)}
+            <div>
+                <div class="filename">{html.escape(item["filename"])}</div>
+                <div class="stage">{html.escape(item["stage"])} · {item["confidence"]*100:.2f}%</div>
+                <div class="timestamp">{datetime.fromtimestamp(item["created_at"]):%Y-%m-%d %H:%M:%S}</div>
+            </div>
+        </div></div>""" for item in uploads)
+    st.markdown(items, unsafe_allow_html=True)
+
+    # ================= RE-DOWNLOAD =================
+    # stored PDF, or rendered from the stored report images; never the pipeline.
+    # Fetched for the picked entry when the page renders, so one that artifact
+    # GC has just collected gets a note instead of failing on click
+    downloadable = [item for item in uploads
+                    if item["result_key"] and artifacts.has_report(item["result_key"])]
+    if downloadable:
+        col_pick, col_download = st.columns([3, 1])
+        with col_pick:
+            picked = st.selectbox(
+                "Report",
+                downloadable,
+                format_func=lambda item: f'{item["filename"]} — '
+                                         f'{datetime.fromtimestamp(item["created_at"]):%Y-%m-%d %H:%M}',
+                label_visibility="collapsed"
+            )
+        with col_download:
+            try:
+                pdf = artifacts.report_pdf(picked["result_key"])
+            except KeyError:
+                st.caption("This report is no longer stored.")
+            else:
+                st.download_button(
+                    "⬇️ Download report",
+                    pdf,
+                    file_name="Diabetic_Retinopathy_Report.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+
+col_newer, col_page, col_older = st.columns([1, 2, 1])
+with col_newer:
+    if st.button("← Newer", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+with col_page:
+    st.markdown(
+        f'<p style="text-align:center;color:#9aa6c7;">Page {len(cursors)}</p>',
+        unsafe_allow_html=True
+    )
+with col_older:
+    if st.button("Older →", disabled=next_cursor is None, use_container_width=True):
+        cursors.append(next_cursor)
+        st.rerun()
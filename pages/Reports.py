@@ -1,8 +1,16 @@
 import streamlit as st
-import time
 import os
-import requests
-from report_utils import run_pipeline
+from datetime import datetime
+from report_utils import run_pipeline, model_version, prewarm, file_sha256, PIPELINE_STAGES, CLASS_NAMES
+from model_download import download_model
+from inference_scheduler import get_scheduler
+from result_cache import get_result_cache, result_key
+from inference_service import INFERENCE_URL, ServiceUnavailable, get_inference_client
+from analysis_jobs import get_job_manager
+from admission import Busy
+from history_store import get_history_store
+from artifact_store import get_artifact_store
+from near_duplicates import perceptual_hash, get_near_duplicate_index
 
 # ================= PAGE CONFIG =================
 st.set_page_config(
@@ -178,33 +186,198 @@ uploaded = st.file_uploader(
 MODEL_URL = "https://huggingface.co/Pavansetty/DR-Pavan/resolve/main/efficientnet_b3_state_dict.pt"
 MODEL_PATH = "efficientnet_b3_state_dict.pt"
 
+# the imports were started by app.py; this schedules the model load as soon
+# as the checkpoint is on disk (once per process, later reruns are no-ops).
+# With DR_INFERENCE_URL set, inference_service.py owns the model instead.
+if INFERENCE_URL is None:
+    prewarm(MODEL_PATH)
+    # this user's earlier uploads, for near-duplicate lookups (once per process)
+    get_near_duplicate_index().warm(st.session_state.get("user_email", ""))
+
+# pin the checkpoint; otherwise the digest Hugging Face advertises is checked
+MODEL_SHA256 = os.environ.get("DR_MODEL_SHA256") or None
+
 @st.cache_resource
 def ensure_model():
-    if not os.path.exists(MODEL_PATH):
+    # written by atomic rename after verification, so an existing file is complete
+    stale = MODEL_SHA256 and os.path.exists(MODEL_PATH) and file_sha256(MODEL_PATH) != MODEL_SHA256
+    if not os.path.exists(MODEL_PATH) or stale:
         with st.spinner("Downloading AI model (one-time)…"):
-            r = requests.get(MODEL_URL, timeout=30)
-            r.raise_for_status()
-            with open(MODEL_PATH, "wb") as f:
-                f.write(r.content)
+            bar = st.progress(0.0)
+
+            def on_chunk(done, total):
+                if total:
+                    bar.progress(min(done / total, 1.0))
+
+            download_model(MODEL_URL, MODEL_PATH, MODEL_SHA256, progress=on_chunk)
+            bar.empty()
     return MODEL_PATH
 
-# ================= ANALYSIS =================
-if uploaded is not None:
-    with st.spinner("Analyzing retinal image…"):
-        progress = st.progress(0)
-        for i in range(100):
-            time.sleep(0.01)
-            progress.progress(i + 1)
+STAGE_LABELS = {
+    "load_model": "Loading AI model…",
+    "decode": "Reading image…",
+    "preprocess_fundus": "Preprocessing fundus…",
+    "deep_enhance": "Enhancing image…",
+    "to_tensor_image": "Preparing model input…",
+    "predict": "Running diagnosis…",
+    "report_images": "Preparing report…",
+}
 
+# how often the result panel checks on a running analysis
+JOB_POLL_SECONDS = 0.5
+
+
+def upcoming_label(done_stage):
+    # label the stage that starts after done_stage
+    if done_stage is None:
+        return STAGE_LABELS["load_model"]
+    i = PIPELINE_STAGES.index(done_stage) + 1
+    return STAGE_LABELS.get(PIPELINE_STAGES[i], "") if i < len(PIPELINE_STAGES) else ""
+
+
+def near_duplicate_key(key, user):
+    # where a diagnosis reused from one of user's earlier uploads is kept: the
+    # result cache and artifact store are shared, so it must never sit under
+    # key, which every user uploading these bytes would read
+    return result_key(key.encode(), "near-duplicate:" + user)
+
+
+def start_analysis(key, image_bytes, version, fresh=False):
+    """
+    Submit (or rejoin) the background job for key; returns the job or raises
+    Busy. Unless fresh, a confirmed near-duplicate of one of this user's
+    earlier uploads reuses its diagnosis.
+    """
+    user = st.session_state.get("user_email", "")
+    # the lookup is per user, so only fresh runs and service runs (which do
+    # not look up) can be shared with other users uploading the same bytes
+    job_key = key if fresh or INFERENCE_URL is not None else near_duplicate_key(key, user)
+    jobs = get_job_manager()
+    job = jobs.get(st.session_state.get("analysis_job"))
+    if job is not None and job.key == job_key and job.state != "cancelled":
+        return job
+    if job is not None:
+        # superseded upload: free its worker
+        del st.session_state.analysis_job
+        jobs.cancel(job.job_id)
+
+    artifacts = get_artifact_store()
+    if INFERENCE_URL is None:
         model_path = ensure_model()
-        cls, prob, pdf_bytes = run_pipeline(uploaded.getvalue(), model_path)
-
-    st.session_state.setdefault("upload_history", []).append({
-        "filename": uploaded.name,
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "result": cls,
-        "confidence": f"{prob*100:.2f}%"
-    })
+        scheduler = get_scheduler(model_path)
+
+        def analyse(job):
+            near = {}
+
+            def reuse(fundus):
+                near["phash"] = perceptual_hash(fundus)
+                match = None if fresh else get_near_duplicate_index().find(user, near["phash"], version, fundus)
+                if match is None:
+                    return None
+                _, manifest, _ = match
+                near["analysed_at"] = manifest["created_at"]
+                return manifest["cls"], manifest["prob"]
+
+            cls, prob, report, timings = run_pipeline(
+                image_bytes, model_path, scheduler=scheduler, defer_pdf=True,
+                progress=job.progress, return_timings=True, reuse=reuse,
+            )
+            return cls, prob, report, timings, near
+    else:
+        # the service runs the whole pipeline; no near-duplicate lookup
+        client = get_inference_client(INFERENCE_URL)
+
+        def analyse(job):
+            return (*client.analyze(image_bytes), {})
+
+    def work(job):
+        # PDF is rendered only when the download is clicked
+        cls, prob, report, timings, near = analyse(job)
+        # "previous": when the upload whose diagnosis was reused was analysed
+        previous = near.get("analysed_at")
+        store_key = key if previous is None else near_duplicate_key(key, user)
+        result = {"cls": cls, "prob": prob, "pdf": report, "timings": timings,
+                  "phash": near.get("phash"), "previous": previous, "result_key": store_key}
+        # thumbnail + report for the History page
+        artifacts.put(store_key, image_bytes, cls, prob, report, version)
+        get_result_cache().put(store_key, result)
+        return result
+
+    # queued per user: one clinician's burst waits behind the others, not in front
+    job = jobs.submit(job_key, work, user=st.session_state.get("user_email"))
+    st.session_state.analysis_job = job.job_id
+    return job
+
+
+def cancel_analysis():
+    job_id = st.session_state.pop("analysis_job", None)
+    if job_id is not None:
+        get_job_manager().cancel(job_id)
+
+
+def cached_result(key, fresh):
+    # a model result for these exact bytes first, then this user's reused one
+    cache = get_result_cache()
+    result = cache.get(key)
+    if (result is None or result.get("pdf") is None) and not fresh:
+        result = cache.get(near_duplicate_key(key, st.session_state.get("user_email", "")))
+    # disk-tier hits whose PDF was never rendered have no report to offer
+    if result is None or result.get("pdf") is None:
+        return None
+    return result
+
+
+def result_panel(key, filename, job_id, polling, fresh):
+    """Progress while the job runs, then the result card and download button."""
+    result = cached_result(key, fresh)
+    if result is None:
+        job = get_job_manager().get(job_id)
+        if job is None or job.state == "cancelled":
+            st.rerun()
+        if not job.done():
+            position = get_job_manager().position(job)
+            if position:
+                st.progress(0.0, text=f"Server busy — you are number {position} in the queue…")
+            else:
+                st.progress(min(job.fraction, 1.0), text=upcoming_label(job.stage))
+            return
+        if polling:
+            # finished: one full rerun renders this panel without run_every
+            st.rerun()
+        error = job.exception()
+        if isinstance(error, ValueError):
+            st.error("Could not read this image. Please upload a JPG or PNG fundus photo.")
+            return
+        if isinstance(error, ServiceUnavailable):
+            st.error("The analysis service is unavailable. Please try again shortly.")
+            return
+        if error is not None:
+            raise error
+        result = job.result()
+    elif polling:
+        st.rerun()
+
+    # bytes or a DeferredReport, which st.download_button calls on click
+    cls, prob, pdf_data = result["cls"], result["prob"], result["pdf"]
+    user = st.session_state.get("user_email", "")
+
+    stored_as = result.get("result_key", key)
+    # once per analysis, not per rerun; kept across reloads by history_store.py
+    if st.session_state.get("last_result_key") != stored_as:
+        st.session_state.last_result_key = stored_as
+        phash = result.get("phash")
+        get_history_store().add(user, filename, CLASS_NAMES[cls], prob, result_key=stored_as, phash=phash)
+        if phash is not None:
+            get_near_duplicate_index().add(user, phash, stored_as)
+
+    analysed_at = result.get("previous")
+    if analysed_at is not None:
+        st.info(f"Previously analysed: this image matches your upload from "
+                f"{datetime.fromtimestamp(analysed_at):%Y-%m-%d %H:%M}, so that diagnosis is shown. "
+                "The report uses this upload's images.")
+        if st.button("Analyse this image again"):
+            st.session_state.fresh_analysis = key
+            st.rerun()
 
     st.markdown(f"""
     <div class="card pulse">
@@ -215,7 +388,46 @@ if uploaded is not None:
 
     st.download_button(
         "⬇️ Generate Clinical Report (PDF)",
-        pdf_bytes,
+        pdf_data,
         file_name="Diabetic_Retinopathy_Report.pdf",
         mime="application/pdf"
     )
+
+
+# ================= ANALYSIS =================
+if uploaded is None:
+    cancel_analysis()
+else:
+    image_bytes = uploaded.getvalue()
+    if INFERENCE_URL is None:
+        # waits for the prewarmed model: the version names the backend it runs
+        version = model_version(ensure_model())
+    else:
+        try:
+            version = get_inference_client(INFERENCE_URL).model_version()
+        except ServiceUnavailable:
+            st.error("The analysis service is unavailable. Please try again shortly.")
+            st.stop()
+
+    # reruns (download click, any widget) and repeat uploads hit the cache
+    key = result_key(image_bytes, version)
+    # "Analyse this image again" on a near-duplicate result
+    fresh = st.session_state.get("fresh_analysis") == key
+
+    job = None
+    if cached_result(key, fresh) is None:
+        try:
+            job = start_analysis(key, image_bytes, version, fresh)
+        except Busy as e:
+            # shed rather than queue without bound; any rerun tries again
+            st.warning(f"The analysis queue is full (you would be number {e.position}). "
+                       "Please try again in a moment.")
+            st.button("Try again")
+            st.stop()
+    else:
+        cancel_analysis()
+
+    # only this fragment reruns while polling; the rest of the page stays idle
+    polling = job is not None and not job.done()
+    panel = st.fragment(result_panel, run_every=JOB_POLL_SECONDS if polling else None)
+    panel(key, uploaded.name, job.job_id if job else None, polling, fresh)
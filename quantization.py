@@ -0,0 +1,147 @@
+# ============================
+# INT8 QUANTIZED CPU INFERENCE
+# ============================
+# Opt-in quantized variants of the EfficientNet-B3 classifier:
+#   "dynamic" — dynamic INT8 quantization of the classifier Linear only
+#   "static"  — FX post-training static quantization of the conv trunk
+#               (calibrated over sample fundus images) + dynamic classifier
+#
+# Usage (parity report against FP32):
+#   python quantization.py efficientnet_b3_state_dict.pt calibration_images/
+
+import os
+import io
+import sys
+import copy
+import json
+import time
+import warnings
+
+import cv2
+import torch
+
+QUANTIZATION_MODES = ("dynamic", "static")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+QUANT_ENGINE = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+
+
+def load_calibration_tensors(folder, limit=32):
+    """Run sample images through the normal preprocessing and stack them into one tensor."""
+    from report_utils import preprocess_fundus, deep_enhance, to_tensor_batch
+
+    files = sorted(
+        f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    images = []
+    for name in files:
+        img = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        images.append(deep_enhance(preprocess_fundus(img)))
+
+    if not images:
+        raise ValueError(f"No readable calibration images in {folder}")
+    return to_tensor_batch(images)
+
+
+def quantize_dynamic_classifier(model):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+
+def quantize_static_trunk(model, calibration, batch_size=8):
+    """FX post-training static quantization of the conv trunk, then dynamic INT8 classifier."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = QUANT_ENGINE
+    qconfig_mapping = get_default_qconfig_mapping(QUANT_ENGINE).set_module_name("classifier", None)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, (calibration[:1],))
+        with torch.no_grad():
+            for start in range(0, len(calibration), batch_size):
+                prepared(calibration[start:start + batch_size])
+        converted = convert_fx(prepared)
+
+    return quantize_dynamic_classifier(converted)
+
+
+def quantize_model(model, mode, calibration_dir=None):
+    if mode == "dynamic":
+        return quantize_dynamic_classifier(copy.deepcopy(model))
+    if mode == "static":
+        if not calibration_dir:
+            raise ValueError("static quantization needs a calibration_dir of sample images")
+        return quantize_static_trunk(model, load_calibration_tensors(calibration_dir))
+    raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {QUANTIZATION_MODES}")
+
+
+# =======================================
+# PARITY REPORT
+# =======================================
+
+def model_size_bytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _timed_forward(model, tensor, repeats):
+    with torch.no_grad():
+        model(tensor[:1])  # warmup
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            out = model(tensor)
+            times.append(time.perf_counter() - t0)
+    return torch.softmax(out, dim=1), sorted(times)[len(times) // 2]
+
+
+def parity_report(fp32_model, quant_model, tensor, repeats=3):
+    """Class agreement, probability drift, latency and size of quant_model vs fp32_model."""
+    p_ref, t_ref = _timed_forward(fp32_model, tensor, repeats)
+    p_q, t_q = _timed_forward(quant_model, tensor, repeats)
+
+    drift = (p_ref - p_q).abs()
+    n = len(tensor)
+    return {
+        "images": n,
+        "class_agreement": (p_ref.argmax(1) == p_q.argmax(1)).float().mean().item(),
+        "prob_drift_max": drift.max().item(),
+        "prob_drift_mean": drift.mean().item(),
+        "fp32_ms_per_image": t_ref / n * 1000.0,
+        "int8_ms_per_image": t_q / n * 1000.0,
+        "speedup": t_ref / t_q if t_q else 0.0,
+        "fp32_size_bytes": model_size_bytes(fp32_model),
+        "int8_size_bytes": model_size_bytes(quant_model),
+    }
+
+
+def main(argv):
+    if len(argv) < 2:
+        print("usage: python quantization.py MODEL_PATH CALIBRATION_DIR [EVAL_DIR]")
+        return 2
+
+    from report_utils import load_model
+
+    model_path, calibration_dir = argv[0], argv[1]
+    eval_dir = argv[2] if len(argv) > 2 else calibration_dir
+
+    fp32, _ = load_model(model_path)
+    tensor = load_calibration_tensors(eval_dir)
+    report = {}
+    for mode in QUANTIZATION_MODES:
+        quant = quantize_model(fp32, mode, calibration_dir)
+        report[mode] = parity_report(fp32, quant, tensor)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,47 +2,233 @@
 # BLOCK 1 — IMPORTS & PATHS
 # ============================
 import os
-import cv2
-import torch
-import numpy as np
-from PIL import Image
-from torchvision import transforms, models
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
-
-DEVICE = torch.device("cpu")
-print("Using device:", DEVICE)
+import time
+import hashlib
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+
+class _LazyModule:
+    """Stand-in for a heavy module; the real import happens on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+# torch / torchvision / cv2 / reportlab cost ~2 s to import; pages import this
+# module at the top, so they are only loaded when a function first needs them
+# (or ahead of time by prewarm(), see BLOCK 10)
+cv2 = _LazyModule("cv2")
+torch = _LazyModule("torch")
+np = _LazyModule("numpy")
+Image = _LazyModule("PIL.Image")
+transforms = _LazyModule("torchvision.transforms")
+models = _LazyModule("torchvision.models")
+
+DEVICE = "cpu"
+
+# input resolution expected by the EfficientNet-B3 head
+MODEL_INPUT_SIZE = 380
+
+# class names are fixed for your problem (index = model output)
+CLASS_NAMES = [
+    "No DR",
+    "Mild",
+    "Moderate",
+    "Severe",
+    "Proliferative DR"
+]
 
 # --- MODEL CHECKPOINT ---
 MODEL_PATH = None
 
+# --- OPTIONAL INT8 QUANTIZATION ("dynamic" / "static", see quantization.py) ---
+QUANTIZATION = os.environ.get("DR_QUANTIZATION") or None
+CALIBRATION_DIR = os.environ.get("DR_CALIBRATION_DIR")
+
+# --- INFERENCE BACKEND ("eager" / "torchscript" / "compile" / "onnx", see inference_backends.py) ---
+INFERENCE_BACKEND = os.environ.get("DR_INFERENCE_BACKEND", "eager")
+
 # =======================================
 # BLOCK 2 — LOAD MODEL FROM CHECKPOINT
 # =======================================
 
-def load_model(model_path):
-    state_dict = torch.load(model_path, map_location="cpu")
-
-    model = models.efficientnet_b3(weights=None)
-    model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, 5)
-
-    model.load_state_dict(state_dict)
+def load_checkpoint(model_path):
+    """
+    State dict from a checkpoint, memory-mapped so the weights are not read
+    into a second copy; weights_only refuses pickled code. Legacy (non-zip)
+    checkpoints cannot be mapped and are read normally.
+    """
+    try:
+        return torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError as e:
+        if "zipfile" not in str(e) and "mmap" not in str(e):
+            raise
+        return torch.load(model_path, map_location="cpu", weights_only=True)
+
+
+def load_model(model_path, quantization=None, calibration_dir=None):
+    state_dict = load_checkpoint(model_path)
+
+    # built on the meta device (no random init), then pointed at the mapped weights
+    with torch.device("meta"):
+        model = models.efficientnet_b3(weights=None)
+        model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, 5)
+
+    model.load_state_dict(state_dict, assign=True)
     model = model.to(DEVICE)
     model.eval()
 
+    if quantization:
+        from quantization import quantize_model
+        model = quantize_model(model, quantization, calibration_dir)
+
+    return model, list(CLASS_NAMES)
+
+# =======================================
+# BLOCK 2B — PROCESS-WIDE MODEL REGISTRY
+# =======================================
+# One shared eval-mode model per checkpoint, loaded once per process and
+# reused by every session instead of calling load_model() per upload.
+
+_MODEL_REGISTRY = {}
+_HASH_CACHE = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class LoadedModel:
+    def __init__(self, model, class_names, path, sha256, quantization, backend,
+                 memory_bytes, load_seconds, warmup_seconds):
+        self.model = model
+        self.class_names = class_names
+        self.path = path
+        self.sha256 = sha256
+        self.quantization = quantization
+        self.backend = backend
+        self.memory_bytes = memory_bytes
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "sha256": self.sha256,
+            "quantization": self.quantization,
+            "backend": self.backend,
+            "load_seconds": round(self.load_seconds, 4),
+            "warmup_seconds": round(self.warmup_seconds, 4),
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+def model_memory_bytes(model, quantized=False):
+    if quantized:
+        # packed INT8 weights are not exposed as parameters
+        from quantization import model_size_bytes
+        return model_size_bytes(model)
+    return sum(
+        t.numel() * t.element_size()
+        for t in list(model.parameters()) + list(model.buffers())
+    )
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """SHA-256 of a file, cached on (path, size, mtime) so repeat lookups are free."""
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    digest = _HASH_CACHE.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _HASH_CACHE[key] = digest
+    return digest
+
+
+def warmup_model(model):
+    dummy = torch.zeros(1, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, device=DEVICE)
+    with torch.no_grad():
+        model(dummy)
+
+
+def get_model(model_path, quantization=QUANTIZATION, backend=INFERENCE_BACKEND):
+    """Return the shared (model, class_names) for a checkpoint, loading it at most once."""
+    entry = _loaded_model(model_path, quantization, backend)
+    return entry.model, entry.class_names
+
+
+def _loaded_model(model_path, quantization, backend):
+    path = os.path.abspath(model_path)
+    key = (path, file_sha256(path), quantization, backend)
+
+    entry = _MODEL_REGISTRY.get(key)
+    if entry is not None:
+        return entry
+
+    with _REGISTRY_LOCK:
+        entry = _MODEL_REGISTRY.get(key)
+        if entry is None:
+            from inference_backends import build_backend
+
+            t0 = time.perf_counter()
+            with span("model_load"):
+                model, class_names = load_model(path, quantization, CALIBRATION_DIR)
+                memory_bytes = model_memory_bytes(model, quantized=bool(quantization))
+                runner, backend_used = build_backend(model, backend, path, key[1], MODEL_INPUT_SIZE,
+                                                     quantization)
+            t1 = time.perf_counter()
+            with span("model_warmup"):
+                warmup_model(runner)
+            t2 = time.perf_counter()
+
+            # a changed checkpoint at the same path replaces the stale entry
+            for old_key in [k for k in _MODEL_REGISTRY if k[0] == path and k[1] != key[1]]:
+                del _MODEL_REGISTRY[old_key]
+
+            entry = LoadedModel(runner, class_names, path, key[1], quantization, backend_used,
+                                memory_bytes, t1 - t0, t2 - t1)
+            _MODEL_REGISTRY[key] = entry
+            logger.info("Model loaded in %.2fs (backend %s, warmup %.2fs)",
+                        entry.load_seconds, backend_used, entry.warmup_seconds)
+
+    return entry
+
+
+def model_version(model_path, quantization=QUANTIZATION, backend=INFERENCE_BACKEND):
+    """
+    Identifies what produced a result: checkpoint hash, quantization mode and
+    the backend the loaded model actually runs (eager when the requested one
+    could not be built). Loads the model if get_model has not.
+    """
+    entry = _loaded_model(model_path, quantization, backend)
+    return f"{entry.sha256[:16]}:{quantization or 'fp32'}:{entry.backend}"
+
+
+def model_registry_stats():
+    return [entry.stats() for entry in list(_MODEL_REGISTRY.values())]
 
-    # class names are fixed for your problem
-    class_names = [
-        "No DR",
-        "Mild",
-        "Moderate",
-        "Severe",
-        "Proliferative DR"
-    ]
 
-    return model, class_names
+def clear_model_registry():
+    with _REGISTRY_LOCK:
+        _MODEL_REGISTRY.clear()
 
 # =======================================
 # BLOCK 3 — FUNDUS PREPROCESSING (YOUR CODE)
@@ -108,14 +294,130 @@ def deep_enhance(img):
 # BLOCK 5 — FINAL DL PREPROCESSING
 # =======================================
 
-transform_dl = transforms.Compose([
-    transforms.Resize((380,380)),
-    transforms.ToTensor(),
-])
+_TRANSFORM_DL = None
+
+def get_transform_dl():
+    global _TRANSFORM_DL
+    if _TRANSFORM_DL is None:
+        _TRANSFORM_DL = transforms.Compose([
+            transforms.Resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)),
+            transforms.ToTensor(),
+        ])
+    return _TRANSFORM_DL
 
 def to_tensor_image(img):
     pil = Image.fromarray(img)
-    return transform_dl(pil).unsqueeze(0).to(DEVICE)
+    return get_transform_dl()(pil).unsqueeze(0).to(DEVICE)
+
+def to_tensor_batch(images):
+    """Stack several preprocessed images into one (N, 3, H, W) tensor."""
+    return torch.cat([to_tensor_image(img) for img in images], dim=0)
+
+# =======================================
+# BLOCK 5B — FUSED PREPROCESSING ENGINE
+# =======================================
+# Same output as preprocess_fundus -> deep_enhance -> to_tensor_image, but:
+#   - CLAHE instances and the Gabor kernel are built once (per thread,
+#     since cv2 CLAHE objects keep internal state)
+#   - colour conversions run on the 512x512 image, straight from BGR,
+#     instead of a full-resolution BGR->RGB pass first
+#   - the grayscale from quality analysis is reused by the Gabor stage,
+#     no defensive copy, and min-max normalize is skipped when it is a no-op
+#   - the final resize writes straight into a preallocated float32 tensor
+
+FUNDUS_SIZE = 512
+CLAHE_CLIP_LIMIT = 3.0
+CLAHE_TILE_GRID = (8, 8)
+LOW_CONTRAST = 35
+LOW_SHARPNESS = 100
+
+
+class PreprocessEngine:
+    def __init__(self, fundus_size=FUNDUS_SIZE, input_size=MODEL_INPUT_SIZE):
+        self.fundus_size = fundus_size
+        self.input_size = input_size
+        self._gabor_kernel = None
+        self._local = threading.local()
+
+    @property
+    def gabor_kernel(self):
+        if self._gabor_kernel is None:
+            self._gabor_kernel = cv2.getGaborKernel((21,21), 8, np.pi/4, 10, 0.5)
+        return self._gabor_kernel
+
+    @property
+    def clahe(self):
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+            self._local.clahe = clahe
+        return clahe
+
+    def _clahe_lab(self, img, code_in, code_out):
+        lab = cv2.cvtColor(img, code_in)
+        l = lab[:, :, 0].copy()
+        lab[:, :, 0] = self.clahe.apply(l)
+        return cv2.cvtColor(lab, code_out)
+
+    def fundus(self, bgr):
+        """preprocess_fundus: BGR decode in, cropped + CLAHE'd RGB out."""
+        img = cv2.resize(bgr, (self.fundus_size, self.fundus_size))
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        _, th = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
+        x,y,w,h = cv2.boundingRect(th)
+        img = img[y:y+h, x:x+w]
+
+        img = self._clahe_lab(img, cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2RGB)
+
+        if img.min() != 0 or img.max() != 255:
+            img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX)
+        return img
+
+    def enhance(self, img):
+        """deep_enhance: returns img itself when no enhancement applies."""
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        contrast = np.std(gray)
+        sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+
+        if contrast < LOW_CONTRAST:
+            img = self._clahe_lab(img, cv2.COLOR_RGB2LAB, cv2.COLOR_LAB2RGB)
+            gray = None
+        if sharpness < LOW_SHARPNESS:
+            if gray is None:
+                gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+            filtered = cv2.filter2D(gray, cv2.CV_8U, self.gabor_kernel)
+            filtered = cv2.cvtColor(filtered, cv2.COLOR_GRAY2RGB)
+            img = cv2.addWeighted(img, 0.7, filtered, 0.3, 0)
+        return img
+
+    def to_tensor(self, img, out=None):
+        """Resize to the model input and write (3, H, W) float32 in [0, 1] into out."""
+        if out is None:
+            out = torch.empty(3, self.input_size, self.input_size, dtype=torch.float32)
+        # PIL bilinear (antialiased) keeps parity with transform_dl
+        size = (self.input_size, self.input_size)
+        resized = np.asarray(Image.fromarray(img).resize(size, Image.BILINEAR))
+        np.divide(resized.transpose(2, 0, 1), np.float32(255), out=out.numpy(), casting="unsafe")
+        return out
+
+    def run(self, bgr):
+        """Full preprocessing for one decoded image: (enhanced RGB, (1, 3, H, W) tensor)."""
+        enhanced = self.enhance(self.fundus(bgr))
+        return enhanced, self.to_tensor(enhanced).unsqueeze(0)
+
+    def run_batch(self, bgr_images):
+        """Preprocess several images into one preallocated (N, 3, H, W) tensor."""
+        batch = torch.empty(len(bgr_images), 3, self.input_size, self.input_size, dtype=torch.float32)
+        enhanced = []
+        for i, bgr in enumerate(bgr_images):
+            img = self.enhance(self.fundus(bgr))
+            self.to_tensor(img, out=batch[i])
+            enhanced.append(img)
+        return enhanced, batch
+
+
+preprocess_engine = PreprocessEngine()
 
 # =======================================
 # BLOCK 6 — RUN MODEL + EXPLANATION
@@ -128,6 +430,19 @@ def predict(model, tensor, class_names):
         cls = torch.argmax(prob).item()
         return cls, prob[0][cls].item()
 
+def predict_batch(model, tensor, class_names):
+    """One forward pass over a stacked batch; returns (cls, prob, probs) per image."""
+    with torch.no_grad():
+        out = model(tensor.to(DEVICE))
+        probs = torch.softmax(out, dim=1)
+        classes = torch.argmax(probs, dim=1)
+
+    results = []
+    for i, cls in enumerate(classes.tolist()):
+        row = probs[i].tolist()
+        results.append((cls, row[cls], row))
+    return results
+
 DR_EXPLANATION = {
     0: "Stage 0 – No Diabetic Retinopathy:\n"
         "There is currently no visible damage to the retina. This means your diabetes has not yet affected the blood vessels of your eye. "
@@ -428,8 +743,7 @@ DR_URGENCY_LEVEL = {
 # BLOCK 7 — PDF GENERATOR (FINAL CLEAN VERSION)
 # =======================================
 
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, Table, TableStyle
-from reportlab.lib import colors
+import copy
 
 def bullet_to_list(text):
     """Convert bullet points into a list for table formatting."""
@@ -437,152 +751,575 @@ def bullet_to_list(text):
     return [[line] for line in lines]
 
 
-def generate_pdf(original_path, processed_path, cls, prob, pdf_path):
-    styles = getSampleStyleSheet()
+# embedded images are printed at 4 inches; 150 dpi is plenty for that
+REPORT_IMAGE_INCHES = 4
+REPORT_IMAGE_DPI = 150
+REPORT_JPEG_QUALITY = 85
+
+
+def report_image_buffer(img, rgb=False):
+    """Downscale an image array to the printed size and JPEG-encode it into a BytesIO."""
     import io
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    max_side = REPORT_IMAGE_INCHES * REPORT_IMAGE_DPI
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))),
+                         interpolation=cv2.INTER_AREA)
+    if rgb:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    ok, enc = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, REPORT_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode report image")
+    return io.BytesIO(enc.tobytes())
+
+
+class PdfTemplate:
+    """
+    Everything in a report that depends only on the DR stage, built once:
+    styles, headings, explanation/advice paragraphs and the colour-coded
+    tables. generate_pdf() only adds the two images and the confidence.
+    """
+
+    def __init__(self, cls, styles=None):
+        from reportlab.platypus import Paragraph, Spacer
+        from reportlab.lib.styles import getSampleStyleSheet
+
+        styles = styles or getSampleStyleSheet()
+        self.cls = cls
+        self.confidence_style = styles['Normal']
+
+        self.head = [
+            Paragraph("<b>Diabetic Retinopathy Report</b>", styles['Title']),
+            Spacer(1, 12),
+            Paragraph("<b>Original Fundus Image</b>", styles['Heading2']),
+        ]
+        self.between_images = [
+            Spacer(1, 12),
+            Paragraph("<b>Processed Image</b>", styles['Heading2']),
+        ]
+        self.before_confidence = [
+            Spacer(1, 12),
+            Paragraph(f"<b>Predicted DR Stage:</b> {cls}", styles['Heading2']),
+        ]
+        self.tail = self._build_tail(cls, styles)
+
+    @staticmethod
+    def _build_tail(cls, styles):
+        from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+        from reportlab.lib import colors
+
+        story = [Spacer(1, 12)]
+
+        # --- EXPLANATION ---
+        story.append(Paragraph("<b>Explanation:</b>", styles['Heading2']))
+        story.append(Paragraph(DR_EXPLANATION[cls], styles['Normal']))
+        story.append(Spacer(1, 12))
+
+        # --- ADVICE ---
+        story.append(Paragraph("<b>Patient Advice:</b>", styles['Heading2']))
+        story.append(Paragraph(DR_ADVICE[cls], styles['Normal']))
+        story.append(Spacer(1, 12))
+
+        # ---------- URGENCY WITH COLOR ----------
+        color = (
+            colors.green if cls == 0 else
+            colors.yellow if cls == 1 else
+            colors.orange if cls in [2, 3] else
+            colors.red
+        )
+
+        story.append(Paragraph("<b>Urgency Level:</b>", styles['Heading2']))
+
+        urgency_table = Table([[DR_URGENCY_LEVEL[cls]]], colWidths=[450])
+        urgency_table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (0,0), color),
+            ('TEXTCOLOR', (0,0), (0,0), colors.black),
+            ('ALIGN', (0,0), (0,0), 'CENTER'),
+            ('FONTSIZE', (0,0), (0,0), 12),
+            ('BOX', (0,0), (0,0), 1, colors.black),
+        ]))
+        story.append(urgency_table)
+        story.append(Spacer(1, 12))
+
+        # ---------- RISK FACTORS TABLE ----------
+        story.append(Paragraph("<b>Risk Factors:</b>", styles['Heading2']))
 
+        risk_table = Table(bullet_to_list(DR_RISK_FACTORS[cls]), colWidths=[450])
+        risk_table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,-1), colors.whitesmoke),
+            ('BOX', (0,0), (-1,-1), 1, colors.black),
+            ('INNERGRID', (0,0), (-1,-1), 0.5, colors.grey),
+        ]))
+        story.append(risk_table)
+        story.append(Spacer(1, 12))
 
-    story = []
+        # ---------- TESTS TABLE ----------
+        story.append(Paragraph("<b>Recommended Tests:</b>", styles['Heading2']))
 
-    story.append(Paragraph("<b>Diabetic Retinopathy Report</b>", styles['Title']))
-    story.append(Spacer(1, 12))
+        tests_table = Table(bullet_to_list(DR_RECOMMENDED_TESTS[cls]), colWidths=[450])
+        tests_table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,-1), colors.lightblue),
+            ('BOX', (0,0), (-1,-1), 1, colors.black),
+            ('INNERGRID', (0,0), (-1,-1), 0.5, colors.darkblue),
+        ]))
+        story.append(tests_table)
+        story.append(Spacer(1, 12))
 
-    # --- ORIGINAL IMAGE ---
-    story.append(Paragraph("<b>Original Fundus Image</b>", styles['Heading2']))
-    story.append(RLImage(original_path, width=4*inch, height=4*inch))
-    story.append(Spacer(1, 12))
+        # ---------- REMAINING TEXT SECTIONS ----------
+        sections = [
+            ("Possible Complications", DR_COMPLICATIONS),
+            ("Emergency Symptoms (Red Flags)", DR_RED_FLAGS),
+            ("Follow-up Frequency", DR_FOLLOW_UP),
+            ("Treatment Options", DR_TREATMENT_OPTIONS),
+            ("Vision Protection Tips", DR_VISION_PROTECTION),
+            ("Daily Lifestyle Routine", DR_LIFESTYLE_ROUTINE),
+            ("Diet Plan Overview", DR_DIET_PLAN),
+        ]
+
+        for title, dictionary in sections:
+            story.append(Paragraph(f"<b>{title}:</b>", styles['Heading2']))
+            story.append(Paragraph(dictionary[cls], styles['Normal']))
+            story.append(Spacer(1, 12))
+
+        return story
+
+    def story(self, original, processed, prob):
+        from reportlab.platypus import Paragraph, Image as RLImage
+        from reportlab.lib.units import inch
+
+        # layout (wrap/split) stores state on the flowable, so each build
+        # gets shallow copies that still share the parsed paragraph text
+        def fresh(flowables):
+            return [copy.copy(f) for f in flowables]
+
+        return (
+            fresh(self.head)
+            + [RLImage(original, width=4*inch, height=4*inch)]
+            + fresh(self.between_images)
+            + [RLImage(processed, width=4*inch, height=4*inch)]
+            + fresh(self.before_confidence)
+            + [Paragraph(f"<b>Confidence:</b> {prob*100:.2f}%", self.confidence_style)]
+            + fresh(self.tail)
+        )
+
+
+def build_pdf_templates():
+    from reportlab.lib.styles import getSampleStyleSheet
 
-    # --- PROCESSED IMAGE ---
-    story.append(Paragraph("<b>Processed Image</b>", styles['Heading2']))
-    story.append(RLImage(processed_path, width=4*inch, height=4*inch))
-    story.append(Spacer(1, 12))
+    styles = getSampleStyleSheet()
+    return {cls: PdfTemplate(cls, styles) for cls in DR_EXPLANATION}
 
-    # --- RESULT ---
-    story.append(Paragraph(f"<b>Predicted DR Stage:</b> {cls}", styles['Heading2']))
-    story.append(Paragraph(f"<b>Confidence:</b> {prob*100:.2f}%", styles['Normal']))
-    story.append(Spacer(1, 12))
 
-    # --- EXPLANATION ---
-    story.append(Paragraph("<b>Explanation:</b>", styles['Heading2']))
-    story.append(Paragraph(DR_EXPLANATION[cls], styles['Normal']))
-    story.append(Spacer(1, 12))
+_PDF_TEMPLATES = None
+_PDF_TEMPLATES_LOCK = threading.Lock()
 
-    # --- ADVICE ---
-    story.append(Paragraph("<b>Patient Advice:</b>", styles['Heading2']))
-    story.append(Paragraph(DR_ADVICE[cls], styles['Normal']))
-    story.append(Spacer(1, 12))
 
-    # ========================================================
-    # NEW SECTIONS (COLOR CODED + TABLE FORMATTED)
-    # ========================================================
+def get_pdf_templates():
+    """Per-stage templates, built on first use (or by prewarm())."""
+    global _PDF_TEMPLATES
+    if _PDF_TEMPLATES is None:
+        with _PDF_TEMPLATES_LOCK:
+            if _PDF_TEMPLATES is None:
+                from reportlab import rl_config
 
-    # ---------- URGENCY WITH COLOR ----------
-    color = (
-        colors.green if cls == 0 else
-        colors.yellow if cls == 1 else
-        colors.orange if cls in [2, 3] else
-        colors.red
-    )
+                # JPEGs are embedded as raw binary streams instead of ASCII85
+                # text, which is ~25% smaller and skips ReportLab's
+                # pure-Python base85 encoder
+                rl_config.useA85 = 0
+                _PDF_TEMPLATES = build_pdf_templates()
+    return _PDF_TEMPLATES
 
-    story.append(Paragraph("<b>Urgency Level:</b>", styles['Heading2']))
-
-    urgency_table = Table([[DR_URGENCY_LEVEL[cls]]], colWidths=[450])
-    urgency_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (0,0), color),
-        ('TEXTCOLOR', (0,0), (0,0), colors.black),
-        ('ALIGN', (0,0), (0,0), 'CENTER'),
-        ('FONTSIZE', (0,0), (0,0), 12),
-        ('BOX', (0,0), (0,0), 1, colors.black),
-    ]))
-    story.append(urgency_table)
-    story.append(Spacer(1, 12))
-
-    # ---------- RISK FACTORS TABLE ----------
-    story.append(Paragraph("<b>Risk Factors:</b>", styles['Heading2']))
-
-    risk_list = bullet_to_list(DR_RISK_FACTORS[cls])
-    risk_table = Table(risk_list, colWidths=[450])
-    risk_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), colors.whitesmoke),
-        ('BOX', (0,0), (-1,-1), 1, colors.black),
-        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.grey),
-    ]))
-    story.append(risk_table)
-    story.append(Spacer(1, 12))
-
-    # ---------- TESTS TABLE ----------
-    story.append(Paragraph("<b>Recommended Tests:</b>", styles['Heading2']))
-
-    tests_list = bullet_to_list(DR_RECOMMENDED_TESTS[cls])
-    tests_table = Table(tests_list, colWidths=[450])
-    tests_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,-1), colors.lightblue),
-        ('BOX', (0,0), (-1,-1), 1, colors.black),
-        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.darkblue),
-    ]))
-    story.append(tests_table)
-    story.append(Spacer(1, 12))
-
-    # ---------- REMAINING TEXT SECTIONS ----------
-    sections = [
-        ("Possible Complications", DR_COMPLICATIONS),
-        ("Emergency Symptoms (Red Flags)", DR_RED_FLAGS),
-        ("Follow-up Frequency", DR_FOLLOW_UP),
-        ("Treatment Options", DR_TREATMENT_OPTIONS),
-        ("Vision Protection Tips", DR_VISION_PROTECTION),
-        ("Daily Lifestyle Routine", DR_LIFESTYLE_ROUTINE),
-        ("Diet Plan Overview", DR_DIET_PLAN),
-    ]
-
-    for title, dictionary in sections:
-        story.append(Paragraph(f"<b>{title}:</b>", styles['Heading2']))
-        story.append(Paragraph(dictionary[cls], styles['Normal']))
-        story.append(Spacer(1, 12))
 
-    # ========================================================
-    # END BLOCK
-    # ========================================================
+def generate_pdf(original, processed, cls, prob, pdf_path=None, template=None):
+    """
+    Build the report PDF and return its bytes. original / processed are
+    file paths or file-like objects (e.g. from report_image_buffer); the
+    bytes are also written to pdf_path when one is given.
+    """
+    import io
+    from reportlab.platypus import SimpleDocTemplate
+    from reportlab.lib.pagesizes import A4
 
-    doc.build(story)
-    buffer.seek(0)
-    return buffer.read()
+    templates = get_pdf_templates()
+    template = template or templates[cls]
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    doc.build(template.story(original, processed, prob))
+
+    pdf_bytes = buffer.getvalue()
+    if pdf_path:
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+    return pdf_bytes
 
 
 
 # =======================================
-# BLOCK 8 — MAIN RUN PIPELINE
+# BLOCK 7A — DEFERRED PDF RENDERING
 # =======================================
+# The classification is shown as soon as predict() returns; the report is
+# rendered on a small background pool when start() is called, or inline on
+# first get() (e.g. when the download is clicked). The bytes are kept on
+# the DeferredReport, so whoever caches the result caches the PDF too.
+
+PDF_WORKERS = int(os.environ.get("DR_PDF_WORKERS", "2"))
+
+_PDF_EXECUTOR = None
+_PDF_EXECUTOR_LOCK = threading.Lock()
+
+
+def _pdf_executor():
+    global _PDF_EXECUTOR
+    with _PDF_EXECUTOR_LOCK:
+        if _PDF_EXECUTOR is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _PDF_EXECUTOR = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+        return _PDF_EXECUTOR
+
+
+class DeferredReport:
+    def __init__(self, original_jpeg, processed_jpeg, cls, prob):
+        self.original_jpeg = original_jpeg
+        self.processed_jpeg = processed_jpeg
+        self.cls = cls
+        self.prob = prob
+        self._pdf = None
+        self._future = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _render(self):
+        import io
+        with self._lock:
+            if self._pdf is None:
+                with span("generate_pdf"):
+                    self._pdf = generate_pdf(
+                        io.BytesIO(self.original_jpeg), io.BytesIO(self.processed_jpeg),
+                        self.cls, self.prob,
+                    )
+                callbacks, self._callbacks = self._callbacks, []
+            else:
+                callbacks = []
+        for fn in callbacks:
+            fn(self._pdf)
+        return self._pdf
+
+    def start(self):
+        """Render in the background PDF pool; returns self."""
+        with self._lock:
+            if self._pdf is None and self._future is None:
+                self._future = _pdf_executor().submit(self._render)
+        return self
+
+    def ready(self):
+        return self._pdf is not None
+
+    def get(self, timeout=None):
+        """PDF bytes, rendering now if no background render was started."""
+        if self._pdf is not None:
+            return self._pdf
+        future = self._future
+        if future is not None:
+            return future.result(timeout=timeout)
+        return self._render()
+
+    # lets st.download_button call it lazily when the user clicks
+    __call__ = get
+
+    def add_done_callback(self, fn):
+        """fn(pdf_bytes) once rendered (immediately if it already is)."""
+        with self._lock:
+            if self._pdf is None:
+                self._callbacks.append(fn)
+                return
+        fn(self._pdf)
 
-def run_pipeline(image_bytes, model_path):
-    print("Loading model...")
-    model, class_names = load_model(model_path)
+# =======================================
+# BLOCK 7B — IMAGE INGEST (REDUCED-RESOLUTION DECODE)
+# =======================================
+# Fundus cameras produce 3000-4000px JPEGs that preprocess_fundus shrinks to
+# 512x512 straight away. When the header says the image is much larger than
+# that, decode with IMREAD_REDUCED_COLOR_{2,4,8} so libjpeg scales in the DCT
+# domain, and decode from a zero-copy view of the upload bytes.
+
+REDUCED_DECODE = os.environ.get("DR_REDUCED_DECODE", "1") != "0"
+
+_REDUCED_FLAGS = (
+    (8, "IMREAD_REDUCED_COLOR_8"),
+    (4, "IMREAD_REDUCED_COLOR_4"),
+    (2, "IMREAD_REDUCED_COLOR_2"),
+)
+
+
+def image_dimensions(buf):
+    """(format, width, height) from a JPEG/PNG header, or None if not recognised."""
+    mv = memoryview(buf)
+    if len(mv) >= 24 and mv[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png", int.from_bytes(mv[16:20], "big"), int.from_bytes(mv[20:24], "big")
+
+    if len(mv) < 4 or mv[0] != 0xFF or mv[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(mv):
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        # SOF0..SOF15 carry the frame size (C4/C8/CC are DHT/JPG/DAC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(mv[i + 5:i + 7], "big")
+            width = int.from_bytes(mv[i + 7:i + 9], "big")
+            return "jpeg", width, height
+        i += 2 + int.from_bytes(mv[i + 2:i + 4], "big")
+    return None
+
+
+def reduced_decode_flag(buf, target=FUNDUS_SIZE):
+    """Largest IMREAD_REDUCED_* factor that keeps both sides >= target (JPEG only)."""
+    dims = image_dimensions(buf)
+    if not REDUCED_DECODE or dims is None or dims[0] != "jpeg":
+        return cv2.IMREAD_COLOR, 1
+    _, width, height = dims
+    for factor, flag in _REDUCED_FLAGS:
+        if min(width, height) // factor >= target:
+            return getattr(cv2, flag), factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def decode_image(image_bytes, full_resolution=False):
+    """Decode an upload to BGR without copying the bytes; reduced resolution unless asked."""
+    buf = np.frombuffer(image_bytes, dtype=np.uint8)
+    flag = cv2.IMREAD_COLOR
+    if not full_resolution:
+        flag, _ = reduced_decode_flag(buf)
+    img = cv2.imdecode(buf, flag)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
 
-    print("Reading image...")
-    file_bytes = np.asarray(bytearray(image_bytes), dtype=np.uint8)
-    orig = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-    orig_rgb = cv2.cvtColor(orig, cv2.COLOR_BGR2RGB)
+# =======================================
+# BLOCK 8 — MAIN RUN PIPELINE
+# =======================================
 
-    print("Step 1: Fundus preprocessing...")
-    fundus = preprocess_fundus(orig)
+PIPELINE_STAGES = (
+    "load_model",
+    "decode",
+    "preprocess_fundus",
+    "deep_enhance",
+    "to_tensor_image",
+    "predict",
+    "report_images",
+    "generate_pdf",
+)
+
+
+class _StageClock:
+    """
+    Times consecutive pipeline stages and reports each one as it finishes.
+    Each stage is also an instrumentation span, so per-stage histograms are
+    collected whenever instrumentation is enabled.
+    """
+
+    def __init__(self, stages, progress=None):
+        self.stages = stages
+        self.progress = progress
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        with span(name):
+            yield
+        self.durations[name] = time.perf_counter() - t0
+        if self.progress is not None:
+            self.progress(name, len(self.durations) / len(self.stages), self.durations[name])
+
+
+def run_pipeline(image_bytes, model_path, scheduler=None, full_resolution_pdf=False,
+                 defer_pdf=False, progress=None, return_timings=False, reuse=None):
+    """
+    Returns (cls, prob, pdf). pdf is the report bytes, or with defer_pdf=True
+    an unrendered DeferredReport (call .start() to render in the background,
+    .get() for the bytes).
+
+    progress(stage, fraction_done, seconds) is called as each of
+    PIPELINE_STAGES finishes; with return_timings=True a fourth element,
+    {stage: seconds}, is returned as well.
+
+    reuse(fundus) is called with the preprocess_fundus output; if it
+    returns (cls, prob), e.g. of a confirmed near-duplicate (see
+    near_duplicates.py), that stands in for to_tensor_image and predict.
+    The report is still built from this upload's images.
+    """
+    stages = PIPELINE_STAGES[:-1] if defer_pdf else PIPELINE_STAGES
+    clock = _StageClock(stages, progress)
+
+    with clock.stage("load_model"):
+        model, class_names = get_model(model_path)
+
+    with clock.stage("decode"):
+        orig = decode_image(image_bytes)
+
+    with clock.stage("preprocess_fundus"):
+        fundus = preprocess_engine.fundus(orig)
+
+    reused = reuse(fundus) if reuse is not None else None
+    if reused is not None:
+        # skipped stages do not count towards progress, as with defer_pdf
+        clock.stages = tuple(s for s in stages if s not in ("to_tensor_image", "predict"))
+
+    with clock.stage("deep_enhance"):
+        enhanced = preprocess_engine.enhance(fundus)
+
+    if reused is not None:
+        cls, prob = reused
+    else:
+        with clock.stage("to_tensor_image"):
+            tensor = preprocess_engine.to_tensor(enhanced).unsqueeze(0)
+
+        with clock.stage("predict"):
+            if scheduler is not None:
+                # shared micro-batching queue (see inference_scheduler.py)
+                cls, prob, _ = scheduler.predict(tensor)
+            else:
+                cls, prob = predict(model, tensor, class_names)
+
+    # in-memory JPEGs at print size (no shared temp files between sessions)
+    with clock.stage("report_images"):
+        if full_resolution_pdf:
+            orig = decode_image(image_bytes, full_resolution=True)
+        original_jpeg = report_image_buffer(orig)
+        processed_jpeg = report_image_buffer(enhanced, rgb=True)
+
+    if defer_pdf:
+        pdf = DeferredReport(original_jpeg.getvalue(), processed_jpeg.getvalue(), cls, prob)
+    else:
+        with clock.stage("generate_pdf"):
+            pdf = generate_pdf(original_jpeg, processed_jpeg, cls, prob)
+
+    if return_timings:
+        return cls, prob, pdf, clock.durations
+    return cls, prob, pdf
 
-    print("Step 2: Deep enhancement...")
-    enhanced = deep_enhance(fundus)
 
-    print("Converting to tensor...")
-    tensor = to_tensor_image(enhanced)
+# =======================================
+# BLOCK 9 — BATCHED RUN PIPELINE
+# =======================================
 
-    print("Predicting...")
-    cls, prob = predict(model, tensor, class_names)
+MAX_BATCH_SIZE = 16
+
+def run_pipeline_batch(images_bytes, model_path, max_batch_size=MAX_BATCH_SIZE, with_pdf=True):
+    """
+    Run many uploads through the model in stacked forward passes of at most
+    max_batch_size images. Returns one dict per input, in order, with the
+    predicted class, its probability, the full probability vector and
+    (optionally) the PDF report bytes.
+    """
+    if max_batch_size < 1:
+        raise ValueError("max_batch_size must be >= 1")
+
+    model, class_names = get_model(model_path)
+    images_bytes = list(images_bytes)
+    results = []
+
+    for start in range(0, len(images_bytes), max_batch_size):
+        with span("batch_decode"):
+            originals = [decode_image(b) for b in images_bytes[start:start + max_batch_size]]
+        with span("batch_preprocess"):
+            enhanced_images, tensor = preprocess_engine.run_batch(originals)
+        with span("predict_batch"):
+            predictions = predict_batch(model, tensor, class_names)
+
+        for orig, enhanced, (cls, prob, probs) in zip(originals, enhanced_images, predictions):
+            pdf_bytes = None
+            if with_pdf:
+                with span("generate_pdf"):
+                    pdf_bytes = generate_pdf(
+                        report_image_buffer(orig), report_image_buffer(enhanced, rgb=True), cls, prob
+                    )
+
+            results.append({
+                "cls": cls,
+                "prob": prob,
+                "probs": probs,
+                "pdf": pdf_bytes,
+            })
+
+    return results
 
-    # save images (for PDF)
-    orig_save = "temp_original.png"
-    proc_save = "temp_processed.png"
-    cv2.imwrite(orig_save, cv2.cvtColor(orig_rgb, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(proc_save, cv2.cvtColor(enhanced, cv2.COLOR_RGB2BGR))
 
-    print("Generating PDF...")
-    pdf_bytes = generate_pdf(orig_save, proc_save, cls, prob, None)
-    return cls, prob, pdf_bytes
+# =======================================
+# BLOCK 10 — PREWARM + LAZY MODULE ATTRIBUTES
+# =======================================
 
+_PREWARM_THREADS = {}
+_PREWARM_LOCK = threading.Lock()
+
+
+def prewarm(model_path=None, background=True):
+    """
+    Pay the cold-start cost ahead of the first upload: import torch, cv2 and
+    reportlab, build the PDF templates and, if model_path exists, load the
+    shared model. The imports run once per process and each model once, in
+    daemon threads by default, so a later call naming a model (e.g. the
+    Reports page after app.py) still schedules its load.
+    """
+    def warm_imports():
+        t0 = time.perf_counter()
+        for module in (np, cv2, torch, models, transforms, Image):
+            module._load()
+        preprocess_engine.gabor_kernel
+        get_pdf_templates()
+        logger.info("report_utils prewarmed in %.2fs", time.perf_counter() - t0)
+
+    def warm_model(imports):
+        if imports is not None:
+            imports.join()
+        get_model(model_path)
+
+    # not downloaded yet: a call after the download schedules it
+    has_model = bool(model_path) and os.path.exists(model_path)
+
+    if not background:
+        warm_imports()
+        if has_model:
+            warm_model(None)
+        return None
+
+    with _PREWARM_LOCK:
+        imports = _PREWARM_THREADS.get(None)
+        if imports is None:
+            imports = _start_prewarm(None, warm_imports)
+        if not has_model:
+            return imports
+        key = os.path.abspath(model_path)
+        thread = _PREWARM_THREADS.get(key)
+        if thread is None:
+            thread = _start_prewarm(key, lambda: warm_model(imports))
+        return thread
+
+
+def _start_prewarm(key, target):
+    thread = threading.Thread(target=target, name="report-utils-prewarm", daemon=True)
+    _PREWARM_THREADS[key] = thread
+    thread.start()
+    return thread
+
+
+def __getattr__(name):
+    # names that used to be built at import time
+    if name == "transform_dl":
+        return get_transform_dl()
+    if name == "PDF_TEMPLATES":
+        return get_pdf_templates()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    # python -m report_utils: headless batch screening (see batch_screening.py)
+    import sys
+    from batch_screening import main
+    sys.exit(main(sys.argv[1:]))
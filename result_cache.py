@@ -0,0 +1,185 @@
+# ============================
+# CONTENT-ADDRESSED RESULT CACHE
+# ============================
+# Pipeline results keyed by sha256(image bytes) + model version, held in a
+# bounded in-memory LRU shared by every session, with an optional on-disk
+# tier (DR_RESULT_CACHE_DIR) that survives restarts. A repeat upload or a
+# Streamlit rerun returns class, probability and PDF bytes without
+# touching the model. "pdf" may be bytes or a report_utils.DeferredReport;
+# a deferred PDF is written to disk once it has been rendered, and an
+# entry read back from disk without one has pdf=None.
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from atomic_files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.environ.get("DR_RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_DIR = os.environ.get("DR_RESULT_CACHE_DIR") or None
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("DR_RESULT_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+
+def result_key(image_bytes, model_version):
+    h = hashlib.sha256(image_bytes)
+    h.update(b"\0")
+    h.update(model_version.encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, disk_dir=RESULT_CACHE_DIR,
+                 max_disk_bytes=RESULT_CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---------- public API ----------
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_memory(key, value)
+        self._disk_put(key, value)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # ---------- memory tier ----------
+
+    def _put_memory(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # ---------- disk tier ----------
+    # <key>.json holds the scalar fields, <key>.pdf the report bytes
+
+    def _paths(self, key):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".json", base + ".pdf"
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        meta_path, pdf_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            value["pdf"] = None
+            if os.path.exists(pdf_path):
+                with open(pdf_path, "rb") as f:
+                    value["pdf"] = f.read()
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        meta_path, pdf_path = self._paths(key)
+        meta = {k: v for k, v in value.items() if k != "pdf"}
+        pdf = value.get("pdf")
+        try:
+            if isinstance(pdf, (bytes, bytearray)):
+                atomic_write(pdf_path, pdf)
+            atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Result cache disk write failed: %s", e)
+            return
+
+        if pdf is not None and hasattr(pdf, "add_done_callback"):
+            # DeferredReport: persist the PDF once someone renders it
+            pdf.add_done_callback(lambda data: self._disk_put_pdf(pdf_path, data))
+        self._disk_gc()
+
+    def _disk_put_pdf(self, pdf_path, data):
+        try:
+            atomic_write(pdf_path, data)
+        except OSError as e:
+            logger.warning("Result cache disk write failed: %s", e)
+
+    def _disk_gc(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            meta_path, pdf_path = self._paths(name[:-5])
+            try:
+                size = os.path.getsize(meta_path)
+                if os.path.exists(pdf_path):
+                    size += os.path.getsize(pdf_path)
+                files.append((os.path.getmtime(meta_path), size, meta_path, pdf_path))
+            except OSError:
+                continue
+            total += size
+
+        files.sort()
+        while total > self.max_disk_bytes and files:
+            _, size, meta_path, pdf_path = files.pop(0)
+            for p in (meta_path, pdf_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+            with self._lock:
+                self._stats["disk_evictions"] += 1
+
+
+_RESULT_CACHE = None
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide result cache shared by every session."""
+    global _RESULT_CACHE
+    with _RESULT_CACHE_LOCK:
+        if _RESULT_CACHE is None:
+            _RESULT_CACHE = ResultCache()
+        return _RESULT_CACHE
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def checkpoint(tmp_path_factory):
+    """
+    A randomly initialised EfficientNet-B3 state dict with the 5-class head,
+    whose output depends on its input. With default BatchNorm running stats
+    activations shrink ~100x per stage and every input gives the same logits,
+    so the stats are recomputed from random batches at the pipeline's input
+    size and the head is scaled up.
+    """
+    import torch
+    from torchvision import models
+
+    torch.manual_seed(0)
+    model = models.efficientnet_b3(weights=None)
+    model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, 5)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.reset_running_stats()
+            module.momentum = None  # cumulative average
+    model.train()
+    with torch.no_grad():
+        model(torch.randn(4, 3, 380, 380))
+        model.classifier[1].weight.mul_(10)
+        model.classifier[1].bias.mul_(10)
+    path = tmp_path_factory.mktemp("model") / "efficientnet_b3_state_dict.pt"
+    torch.save(model.state_dict(), path)
+    return str(path)
@@ -0,0 +1,33 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+import batch_screening
+from benchmark import synthetic_fundus
+
+
+def test_bad_images_become_error_rows(checkpoint, tmp_path):
+    images = tmp_path / "imgs"
+    images.mkdir()
+    for seed in range(3):
+        cv2.imwrite(str(images / f"good{seed}.jpg"), synthetic_fundus(400, 300, seed=seed))
+    # nothing to crop: OpenCV raises cv2.error, not OSError/ValueError
+    cv2.imwrite(str(images / "black.jpg"), np.zeros((300, 400, 3), np.uint8))
+    (images / "truncated.jpg").write_bytes(b"not a jpeg")
+
+    output = tmp_path / "results.jsonl"
+    pdfs = tmp_path / "pdfs"
+    summary = batch_screening.screen(batch_screening.list_images(str(images)), str(output),
+                                     checkpoint, pdf_dir=str(pdfs), workers=2, batch_size=2)
+
+    rows = {os.path.basename(r["path"]): r for r in map(json.loads, output.read_text().splitlines())}
+    assert summary["images"] == 5 and summary["errors"] == 2 and summary["pdfs"] == 3
+    assert set(rows) == {"good0.jpg", "good1.jpg", "good2.jpg", "black.jpg", "truncated.jpg"}
+    assert rows["black.jpg"]["error"].startswith("error:")
+    assert rows["truncated.jpg"]["error"]
+    for name in ("good0.jpg", "good1.jpg", "good2.jpg"):
+        assert rows[name]["error"] is None
+        assert rows[name]["stage"] is not None
+        assert os.path.exists(rows[name]["pdf"])
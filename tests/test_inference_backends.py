@@ -0,0 +1,63 @@
+import os
+
+import pytest
+import torch
+
+import report_utils as ru
+from inference_backends import PARITY_ATOL, artifact_path, build_backend
+
+
+@pytest.fixture
+def registry():
+    ru.clear_model_registry()
+    yield
+    ru.clear_model_registry()
+
+
+def logits(model, tensor):
+    with torch.no_grad():
+        return model(tensor)
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "compile", "onnx"])
+def test_backend_matches_eager(checkpoint, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    model, _ = ru.load_model(checkpoint)
+    runner, used = build_backend(model, backend, checkpoint, ru.file_sha256(checkpoint), 64)
+    assert used == backend
+
+    # a batch size other than the probe's
+    tensor = torch.randn(3, 3, 64, 64)
+    expected = logits(model, tensor)
+    # distinct inputs give distinct outputs, so a runner ignoring its input fails
+    assert (expected[1:] - expected[0]).abs().max().item() > 10 * PARITY_ATOL
+    assert torch.allclose(logits(runner, tensor), expected, atol=PARITY_ATOL, rtol=0)
+
+
+def test_artifact_path_distinguishes_quantization():
+    paths = {artifact_path("/m/model.pt", "ab" * 32, "torchscript", q) for q in (None, "dynamic", "static")}
+    assert len(paths) == 3
+    assert all(torch.__version__ in p for p in paths)
+
+
+def test_quantized_export_does_not_reuse_fp32_graph(checkpoint, registry):
+    # FP32 first: its export must not be picked up by the INT8 model after it
+    fp32, _ = ru.get_model(checkpoint, quantization=None, backend="torchscript")
+    int8, _ = ru.get_model(checkpoint, quantization="dynamic", backend="torchscript")
+
+    assert "quantized" not in str(fp32.graph)
+    assert "quantized" in str(int8.graph)
+    sha = ru.file_sha256(checkpoint)
+    assert os.path.exists(artifact_path(checkpoint, sha, "torchscript", None))
+    assert os.path.exists(artifact_path(checkpoint, sha, "torchscript", "dynamic"))
+    assert {(e["quantization"], e["backend"]) for e in ru.model_registry_stats()} == {
+        (None, "torchscript"), ("dynamic", "torchscript")}
+
+
+def test_model_version_records_backend_used(checkpoint, registry):
+    assert ru.model_version(checkpoint, None, "eager").endswith(":fp32:eager")
+    assert ru.model_version(checkpoint, None, "torchscript").endswith(":fp32:torchscript")
+    # a backend that cannot be built falls back to eager, and says so
+    assert ru.model_version(checkpoint, None, "tensorrt").endswith(":fp32:eager")
+    assert ru.model_version(checkpoint, "dynamic", "torchscript").endswith(":dynamic:torchscript")
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import report_utils as ru
+from model_download import ChecksumMismatch, download_model
+
+
+class StandIn:
+    """Local HTTP server for one file, with an ETag and Range support like Hugging Face's CDN."""
+
+    def __init__(self, data, etag=None):
+        self.data = data
+        self.etag = etag or hashlib.sha256(data).hexdigest()
+        self.drop_after = None  # bytes sent before the next response is cut off
+        self.ranges = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                header = self.headers.get("Range")
+                stand_in.ranges.append(header)
+                start = int(header[len("bytes="):].rstrip("-")) if header else 0
+                if start >= len(stand_in.data):
+                    self.send_response(416)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = stand_in.data[start:]
+                self.send_response(206 if header else 200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", f'"{stand_in.etag}"')
+                self.end_headers()
+                if stand_in.drop_after is not None:
+                    body, stand_in.drop_after = body[:stand_in.drop_after], None
+                    self.close_connection = True
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/efficientnet_b3_state_dict.pt"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def checkpoint_bytes(checkpoint):
+    with open(checkpoint, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(data, etag=None):
+        servers.append(StandIn(data, etag))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_resumes_dropped_download_and_verifies_etag(tmp_path, checkpoint, checkpoint_bytes, serve):
+    server = serve(checkpoint_bytes)
+    dest = str(tmp_path / "model.pt")
+    cut = len(checkpoint_bytes) // 3
+    server.drop_after = cut
+
+    with pytest.raises((requests.RequestException, IOError)):
+        download_model(server.url, dest)
+    assert not os.path.exists(dest)
+    # whole chunks received before the drop are kept
+    kept = os.path.getsize(dest + ".part")
+    assert 0 < kept <= cut
+
+    digest = download_model(server.url, dest)
+    assert server.ranges == [None, f"bytes={kept}-"]
+    assert digest == hashlib.sha256(checkpoint_bytes).hexdigest()
+    assert not os.path.exists(dest + ".part")
+    with open(dest, "rb") as f:
+        assert f.read() == checkpoint_bytes
+    assert ru.load_checkpoint(dest).keys() == ru.load_checkpoint(checkpoint).keys()
+
+
+def test_complete_part_file_is_finished_without_refetching(tmp_path, checkpoint_bytes, serve):
+    server = serve(checkpoint_bytes)
+    dest = str(tmp_path / "model.pt")
+    with open(dest + ".part", "wb") as f:
+        f.write(checkpoint_bytes)
+
+    assert download_model(server.url, dest) == hashlib.sha256(checkpoint_bytes).hexdigest()
+    assert server.ranges == [f"bytes={len(checkpoint_bytes)}-"]
+    assert os.path.getsize(dest) == len(checkpoint_bytes)
+
+
+def test_mismatched_etag_drops_part_file(tmp_path, checkpoint_bytes, serve):
+    server = serve(checkpoint_bytes, etag="0" * 64)
+    dest = str(tmp_path / "model.pt")
+
+    with pytest.raises(ChecksumMismatch):
+        download_model(server.url, dest)
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + ".part")
+
+
+def test_pinned_sha256_overrides_advertised_one(tmp_path, checkpoint_bytes, serve):
+    server = serve(checkpoint_bytes)
+    dest = str(tmp_path / "model.pt")
+
+    with pytest.raises(ChecksumMismatch):
+        download_model(server.url, dest, sha256="f" * 64)
+    assert not os.path.exists(dest) and not os.path.exists(dest + ".part")
+
+    pinned = hashlib.sha256(checkpoint_bytes).hexdigest()
+    assert download_model(server.url, dest, sha256=pinned.upper()) == pinned
@@ -0,0 +1,99 @@
+import hashlib
+
+import cv2
+import numpy as np
+import pytest
+
+import report_utils as ru
+from artifact_store import ArtifactStore
+from benchmark import synthetic_fundus
+from history_store import HistoryStore
+from near_duplicates import NEAR_DUPLICATE_DISTANCE, NearDuplicateIndex, hamming, perceptual_hash
+
+VERSION = "0123456789abcdef:fp32:eager"
+
+# distinct benchmark.synthetic_fundus seeds whose hashes are within the
+# lookup distance, so only confirm() keeps them apart
+COLLIDING = [((2048, 1536), 5, 28), ((800, 600), 3, 131)]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return NearDuplicateIndex(ArtifactStore(str(tmp_path / "artifacts")),
+                              HistoryStore(str(tmp_path / "history.sqlite3")))
+
+
+def jpeg(img, quality=92):
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def fundus_of(image_bytes):
+    return ru.preprocess_engine.fundus(ru.decode_image(image_bytes))
+
+
+def analyse(index, user, image_bytes):
+    """What the Reports page does per upload: look up, else store and index it."""
+    fundus = fundus_of(image_bytes)
+    phash = perceptual_hash(fundus)
+    match = index.find(user, phash, VERSION, fundus)
+    if match is None:
+        key = hashlib.sha256(image_bytes).hexdigest()
+        report = ru.DeferredReport(ru.report_image_buffer(ru.decode_image(image_bytes)).getvalue(),
+                                   ru.report_image_buffer(ru.deep_enhance(fundus), rgb=True).getvalue(),
+                                   0, 0.9)
+        index.artifacts.put(key, image_bytes, 0, 0.9, report, VERSION)
+        index.history.add(user, "fundus.jpg", "No DR", 0.9, result_key=key, phash=phash)
+        index.add(user, phash, key)
+    return match
+
+
+@pytest.mark.parametrize("size, a, b", COLLIDING)
+def test_colliding_hashes_of_distinct_images_are_not_matched(index, size, a, b):
+    first, second = (jpeg(synthetic_fundus(*size, seed=seed)) for seed in (a, b))
+    assert hamming(perceptual_hash(fundus_of(first)), perceptual_hash(fundus_of(second))) <= NEAR_DUPLICATE_DISTANCE
+
+    assert analyse(index, "a@clinic", first) is None
+    assert analyse(index, "a@clinic", second) is None
+    assert index.stats()["rejected"] == 1
+
+
+def test_distinct_fundus_images_are_not_matched(index):
+    for seed in range(60):
+        assert analyse(index, "a@clinic", jpeg(synthetic_fundus(800, 600, seed=seed))) is None, seed
+    assert index.stats()["hits"] == 0
+
+
+def test_reencoded_upload_is_matched(index):
+    # hashes of these re-encodes are 2-4 bits from the original's; about 1 in
+    # 8 re-encodes lands further away and is simply analysed again
+    img = synthetic_fundus(2048, 1536, seed=4)
+    assert analyse(index, "a@clinic", jpeg(img)) is None
+
+    half = cv2.resize(img, (1024, 768), interpolation=cv2.INTER_AREA)
+    brighter = np.clip(img.astype(np.float32) * 1.08, 0, 255).astype(np.uint8)
+    for variant in (jpeg(img, quality=60), jpeg(half), jpeg(brighter)):
+        match = analyse(index, "a@clinic", variant)
+        assert match is not None and match[0] == hashlib.sha256(jpeg(img)).hexdigest()
+
+
+def test_matches_are_scoped_per_user(index):
+    img = synthetic_fundus(2048, 1536, seed=8)
+    assert analyse(index, "a@clinic", jpeg(img)) is None
+    assert analyse(index, "b@clinic", jpeg(img, quality=60)) is None
+    assert analyse(index, "a@clinic", jpeg(img, quality=60)) is not None
+
+
+def test_index_is_rebuilt_from_history_and_skips_collected_results(index, tmp_path):
+    img = synthetic_fundus(2048, 1536, seed=9)
+    assert analyse(index, "a@clinic", jpeg(img)) is None
+
+    # a restarted process builds the user's index from the history rows
+    restarted = NearDuplicateIndex(index.artifacts, index.history)
+    fundus = fundus_of(jpeg(img, quality=60))
+    assert restarted.find("a@clinic", perceptual_hash(fundus), VERSION, fundus) is not None
+    assert restarted.find("a@clinic", perceptual_hash(fundus), "other-model", fundus) is None
+
+    index.artifacts.max_bytes = 0
+    index.artifacts.gc()
+    assert restarted.find("a@clinic", perceptual_hash(fundus), VERSION, fundus) is None
+    assert restarted.stats()["stale"] == 1
@@ -0,0 +1,27 @@
+import cv2
+import pytest
+
+import report_utils as ru
+from benchmark import synthetic_fundus
+
+
+@pytest.mark.parametrize("defer_pdf", [False, True])
+@pytest.mark.parametrize("reused", [None, (2, 0.75)])
+def test_progress_reaches_one(checkpoint, defer_pdf, reused):
+    image_bytes = cv2.imencode(".jpg", synthetic_fundus(800, 600, seed=1))[1].tobytes()
+    calls = []
+    cls, prob, _, timings = ru.run_pipeline(
+        image_bytes, checkpoint, defer_pdf=defer_pdf, return_timings=True,
+        progress=lambda stage, fraction, seconds: calls.append((stage, fraction)),
+        reuse=lambda fundus: reused,
+    )
+
+    fractions = [fraction for _, fraction in calls]
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
+    assert [stage for stage, _ in calls] == list(timings)
+    skipped = {"to_tensor_image", "predict"} if reused else set()
+    if defer_pdf:
+        skipped.add("generate_pdf")
+    assert set(timings) == set(ru.PIPELINE_STAGES) - skipped
+    if reused:
+        assert (cls, prob) == reused
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import report_utils as ru
+from benchmark import synthetic_fundus
+
+engine = ru.preprocess_engine
+
+
+def max_diff(a, b):
+    assert a.shape == b.shape
+    return np.abs(a.astype(np.int16) - b.astype(np.int16)).max()
+
+
+def enhance_inputs():
+    # RGB images for each deep_enhance branch: (CLAHE, Gabor)
+    rng = np.random.default_rng(0)
+    gradient = np.repeat(np.tile(np.linspace(0, 255, 400), (300, 1))[..., None], 3, axis=2)
+    return {
+        (False, False): rng.integers(0, 256, (300, 400, 3), dtype=np.uint8),
+        (True, False): rng.integers(100, 140, (300, 400, 3), dtype=np.uint8),
+        (False, True): gradient.astype(np.uint8),
+        (True, True): cv2.GaussianBlur(rng.integers(90, 150, (300, 400, 3), dtype=np.uint8), (0, 0), 4),
+    }
+
+
+@pytest.mark.parametrize("size", [(800, 600), (2048, 1536)])
+@pytest.mark.parametrize("blur", [False, True])
+def test_fundus_matches_preprocess_fundus(size, blur):
+    bgr = synthetic_fundus(*size, seed=3, blur=blur)
+    assert max_diff(engine.fundus(bgr), ru.preprocess_fundus(bgr)) <= 1
+
+
+@pytest.mark.parametrize("branches", list(enhance_inputs()))
+def test_enhance_matches_deep_enhance(branches):
+    img = enhance_inputs()[branches]
+    _, contrast, sharpness = ru.analyze_quality(img)
+    assert (contrast < ru.LOW_CONTRAST, sharpness < ru.LOW_SHARPNESS) == branches
+
+    expected = ru.deep_enhance(img)
+    assert max_diff(engine.enhance(img.copy()), expected) <= 1
+
+    tensor = engine.to_tensor(expected)
+    assert tensor.shape == (3, ru.MODEL_INPUT_SIZE, ru.MODEL_INPUT_SIZE)
+    assert torch.allclose(tensor, ru.to_tensor_image(expected)[0].cpu(), atol=1 / 255)
+
+
+def test_run_batch_matches_original_chain():
+    images = [synthetic_fundus(800, 600, seed=s, blur=s % 2 == 1) for s in range(4)]
+    enhanced, batch = engine.run_batch(images)
+    for bgr, img, tensor in zip(images, enhanced, batch):
+        expected = ru.deep_enhance(ru.preprocess_fundus(bgr))
+        assert max_diff(img, expected) <= 1
+        assert torch.allclose(tensor, ru.to_tensor_image(expected)[0].cpu(), atol=1 / 255)
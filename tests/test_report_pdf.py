@@ -0,0 +1,76 @@
+import io
+import threading
+
+import cv2
+import pytest
+
+import report_utils as ru
+from benchmark import synthetic_fundus
+
+
+@pytest.fixture(autouse=True)
+def invariant_pdfs():
+    # no timestamps or random document ids, so equal input gives equal bytes
+    from reportlab import rl_config
+    previous, rl_config.invariant = rl_config.invariant, 1
+    yield
+    rl_config.invariant = previous
+
+
+def report_images(seed):
+    img = synthetic_fundus(800, 600, seed=seed)
+    original = ru.report_image_buffer(img).getvalue()
+    processed = ru.report_image_buffer(ru.deep_enhance(ru.preprocess_fundus(img)), rgb=True).getvalue()
+    return original, processed
+
+
+def render(original, processed, cls, prob):
+    return ru.generate_pdf(io.BytesIO(original), io.BytesIO(processed), cls, prob)
+
+
+def upload(seed):
+    return cv2.imencode(".jpg", synthetic_fundus(800, 600, seed=seed))[1].tobytes()
+
+
+def own_report_images(image_bytes):
+    # what run_pipeline embeds: report_image_buffer of the decoded upload and of its enhancement
+    orig = ru.decode_image(image_bytes)
+    enhanced = ru.preprocess_engine.enhance(ru.preprocess_engine.fundus(orig))
+    return ru.report_image_buffer(orig).getvalue(), ru.report_image_buffer(enhanced, rgb=True).getvalue()
+
+
+def test_concurrent_pipelines_never_mix_images(checkpoint):
+    uploads = [upload(seed) for seed in range(8)]
+    images = [own_report_images(b) for b in uploads]
+    expected = [ru.run_pipeline(b, checkpoint)[2] for b in uploads]
+
+    rounds = 2
+    results = [[None] * rounds for _ in uploads]
+    barrier = threading.Barrier(len(uploads))
+
+    def worker(i):
+        for r in range(rounds):
+            barrier.wait()
+            results[i][r] = ru.run_pipeline(uploads[i], checkpoint)[2]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(uploads))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i, (original, processed) in enumerate(images):
+        others = [img for j, pair in enumerate(images) if j != i for img in pair]
+        for pdf in results[i]:
+            # JPEGs are embedded as-is (useA85 = 0), so each one is a substring
+            assert original in pdf and processed in pdf
+            assert not any(img in pdf for img in others)
+            assert pdf == expected[i]
+
+
+def test_deferred_reports_render_their_own_images():
+    jobs = [(report_images(seed), seed % 5, 0.9) for seed in range(20, 26)]
+    reports = [ru.DeferredReport(original, processed, cls, prob).start()
+               for (original, processed), cls, prob in jobs]
+    for report, ((original, processed), cls, prob) in zip(reports, jobs):
+        assert report.get(timeout=60) == render(original, processed, cls, prob)